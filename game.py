@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import random
+import time
 from collections import deque
 
 from consts import KILL_SNAKE_POINTS, TIMEOUT, Direction, HISTORY_LEN, Tiles, SuperFood
@@ -14,10 +15,105 @@ GAME_SPEED = 10
 MAP_SIZE = (48, 24)
 FOOD_IN_MAP = 4
 
+
+class TickScheduler:
+    """Paces game ticks at a fixed rate.
+
+    Ticks are due at absolute deadlines on the monotonic clock, so the work done
+    between ticks is absorbed by the next sleep instead of adding to the period.
+    A tick whose work runs past the next deadline is an overrun: it is reported
+    and the schedule restarts from now rather than bursting to catch up.
+    Unthrottled, ticks run back to back (for benchmarking).
+    """
+
+    def __init__(self, rate, throttled=True):
+        self.period = 1.0 / rate
+        self.throttled = throttled
+        self.ticks = 0
+        self.overruns = 0
+        self.work_total = 0.0
+        self.work_max = 0.0
+        self._deadline = None
+        self._tick_started = None
+
+    async def wait(self):
+        """Wait until the next tick is due"""
+        now = time.monotonic()
+        if self._tick_started is not None:
+            work = now - self._tick_started
+            self.work_total += work
+            self.work_max = max(self.work_max, work)
+
+        if not self.throttled:
+            await asyncio.sleep(0)  # still let other tasks (e.g. sends) run
+        else:
+            if self._deadline is None:
+                self._deadline = now + self.period
+            elif now > self._deadline:
+                self.overruns += 1
+                logger.warning(
+                    "Tick %s overran its deadline by %.1fms (work took %.1fms)",
+                    self.ticks,
+                    (now - self._deadline) * 1000,
+                    work * 1000,
+                )
+                self._deadline = now
+            await asyncio.sleep(self._deadline - time.monotonic())
+            self._deadline += self.period
+
+        self._tick_started = time.monotonic()
+        self.ticks += 1
+
+    def summary(self):
+        mean = self.work_total / self.ticks if self.ticks else 0.0
+        return (
+            f"{self.ticks} ticks, {self.overruns} overruns, "
+            f"work mean {mean * 1000:.1f}ms / max {self.work_max * 1000:.1f}ms "
+            f"(period {self.period * 1000:.1f}ms)"
+        )
+
+
+class Occupancy:
+    """Cell -> names of the (alive) snakes whose body is on it.
+
+    Snakes update it as their head is pushed and their tail popped, so that
+    collision checks and sight marking are O(1) per cell. When given a map,
+    it tells the map which cells become occupied or free.
+    """
+
+    def __init__(self, mapa=None):
+        self._cells = {}
+        self._map = mapa
+
+    def add(self, pos, name):
+        if pos in self._cells:
+            self._cells[pos].append(name)
+        else:
+            self._cells[pos] = [name]
+            if self._map is not None:
+                self._map.occupy(pos)
+
+    def remove(self, pos, name):
+        names = self._cells[pos]
+        names.remove(name)
+        if not names:
+            del self._cells[pos]
+            if self._map is not None:
+                self._map.vacate(pos)
+
+    def occupants(self, pos):
+        return self._cells.get(pos, ())
+
+    def __contains__(self, pos):
+        return pos in self._cells
+
+
 class Snake:
-    def __init__(self, player_name, x=1, y=1):
+    def __init__(self, player_name, x=1, y=1, occupancy=None):
         self._name = player_name
+        self._occupancy = occupancy if occupancy is not None else Occupancy()
         self._body = [(x, y)]
+        self._occupancy.add((x, y), player_name)
         self._spawn_pos = (x, y)
         self._direction: Direction = Direction.EAST
         self._history = deque(maxlen=HISTORY_LEN)
@@ -28,17 +124,15 @@ class Snake:
         self.to_grow = 1
         self.range = 3
 
-    def sight(self, mapa, snakes):
-        in_range = mapa.get_zone(self.head, self.range)
-
-        for snake in snakes:  # mark all snakes in the map
-            if not snake.alive:
-                continue  # ignore dead snakes
-            for x, y in snake.body:
-                if x in in_range and y in in_range[x]:
-                    in_range[x][y] = Tiles.SNAKE
+        # statistics
+        self.foods_eaten = 0
+        self.superfoods_eaten = 0
+        self.death_cause = None
+        self.death_step = None
 
-        return in_range
+    def sight(self, mapa, occupancy):
+        # tiles in range, with all (alive) snakes marked
+        return mapa.get_zone(self.head, self.range, occupancy)
 
     def grow(self, amount=1):
         self.to_grow += amount
@@ -60,7 +154,11 @@ class Snake:
     def alive(self):
         return self._alive
 
-    def kill(self):
+    def kill(self, cause=None):
+        if self._alive:
+            self.death_cause = cause
+            for pos in self._body:  # dead snakes are ignored by everyone
+                self._occupancy.remove(pos, self._name)
         self._alive = False
 
     @property
@@ -101,7 +199,7 @@ class Snake:
 
         new_pos = mapa.calc_pos(self.head, direction, traverse=self._traverse)
 
-        if new_pos == self.head or new_pos in self._body:
+        if new_pos == self.head or self.collision(new_pos):
             # if we can't move to the new position, we crashed against a wall
             # or we are crashing against ourselves
             logger.debug(
@@ -110,24 +208,28 @@ class Snake:
                 new_pos,
                 direction,
             )
-            self.kill()
+            self.kill("wall" if new_pos == self.head else "self")
             return
 
         self._body.append(new_pos)
+        self._occupancy.add(new_pos, self._name)
         if self.to_grow > 0:  # if we are growing
             self.to_grow -= 1
         elif self.to_grow < 0 and len(self._body) > 3:  # if we are shrinking
             self.to_grow += 1
-            self._body.pop(0)
-            self._body.pop(0)
+            self._pop_tail()
+            self._pop_tail()
         else:  # if we are simply moving
-            self._body.pop(0)
+            self._pop_tail()
 
         self._direction = direction
         self._history.append(new_pos)
 
+    def _pop_tail(self):
+        self._occupancy.remove(self._body.pop(0), self._name)
+
     def collision(self, pos):
-        return pos in self._body
+        return self._name in self._occupancy.occupants(pos)
 
     def _calc_dir(self, old_pos, new_pos):
         if old_pos[0] < new_pos[0]:
@@ -159,16 +261,20 @@ def key2direction(key):
 
 
 class Game:
-    def __init__(self, level=1, timeout=TIMEOUT, size=MAP_SIZE, game_speed=GAME_SPEED):
+    def __init__(
+        self, level=1, timeout=TIMEOUT, size=MAP_SIZE, game_speed=GAME_SPEED, throttled=True
+    ):
         logger.info(f"Game(level={level})")
         self.initial_level = level
         self._game_speed = game_speed
+        self._scheduler = TickScheduler(game_speed, throttled)
         self._running = False
         self._timeout = timeout
         self._step = 0
         self._state = {}
         self._snakes = {}
         self.map = Map(size=size)
+        self._occupancy = Occupancy(self.map)
 
     @property
     def snakes(self):
@@ -189,8 +295,9 @@ class Game:
     def start(self, players_names):
         logger.debug("Reset world")
         self._running = True
+        self._occupancy = Occupancy(self.map)
         self._snakes = {
-            player_name: Snake(player_name, *self.map.spawn_snake())
+            player_name: Snake(player_name, *self.map.spawn_snake(), occupancy=self._occupancy)
             for player_name in players_names
         }
         for _ in range(FOOD_IN_MAP):
@@ -198,6 +305,7 @@ class Game:
 
     def stop(self):
         logger.info("GAME OVER")
+        logger.info("Ticks: %s", self._scheduler.summary())
         self._running = False
 
     def quit(self):
@@ -223,15 +331,18 @@ class Game:
                 if snake.lastkey in "wasd" and snake.lastkey != ""
                 else snake.direction,
             )
+            if not snake.alive:
+                snake.death_step = self._step
 
         except AssertionError:
             logger.error("Invalid key <%s> pressed. Valid keys: w,a,s,d", lastkey)
 
         return True
 
-    def kill_snake(self, name):
+    def kill_snake(self, name, cause=None):
         logger.info("[step=%s] Snake <%s> has died", self._step, name)
-        self._snakes[name].kill()
+        self._snakes[name].kill(cause)
+        self._snakes[name].death_step = self._step
 
         if all([not snake.alive for snake in self._snakes.values()]):
             # if all snakes are dead, we stop the game
@@ -246,13 +357,11 @@ class Game:
         for name1, snake1 in self._snakes.items():
             if not snake1.alive:
                 continue
-            # check collisions between snakes
-            for name2, snake2 in self._snakes.items():
-                if not snake2.alive:
-                    continue
-                if name1 != name2 and snake2.collision(snake1.head):
-                    self.kill_snake(name1)
-                    snake2.score += KILL_SNAKE_POINTS
+            # check collisions between snakes (only alive snakes are in the grid)
+            for name2 in list(self._occupancy.occupants(snake1.head)):
+                if name1 != name2:
+                    self.kill_snake(name1, "snake")
+                    self._snakes[name2].score += KILL_SNAKE_POINTS
 
             # check collisions with the map
             if self.map.is_blocked(snake1.head, traverse=snake1._traverse):
@@ -261,7 +370,7 @@ class Game:
                     name1,
                     snake1.head,
                 )
-                self.kill_snake(name1)
+                self.kill_snake(name1, "wall")
 
             # check collisions with the food
             if self.map.get_tile(snake1.head) in [Tiles.FOOD, Tiles.SUPER]:
@@ -269,9 +378,11 @@ class Game:
                 if what_i_ate == Tiles.FOOD:
                     logger.debug("Snake <%s> ate food", name1)
                     snake1.score += 1
+                    snake1.foods_eaten += 1
                     snake1.grow()
                     self.map.spawn_food()
                 elif what_i_ate == Tiles.SUPER:
+                    snake1.superfoods_eaten += 1
                     kind = random.choice(
                         [
                             SuperFood.POINTS,
@@ -299,7 +410,17 @@ class Game:
                         logger.debug("Snake ate superfood and traverse is: %s", snake1._traverse)
 
     async def next_frame(self):
-        await asyncio.sleep(1.0 / self._game_speed)
+        await self._scheduler.wait()
+        return self.step()
+
+    def step(self, actions=None):
+        """Advance the game by one frame, synchronously.
+
+        actions optionally maps player names to the key they pressed this frame.
+        Returns the new state, or None if the game is not running.
+        """
+        for name, key in (actions or {}).items():
+            self.keypress(name, key)
 
         if not self._running:
             logger.info("Waiting for player 1")
@@ -331,7 +452,7 @@ class Game:
                 {
                     "name": name,
                     "body": snake.body[::-1],
-                    "sight": snake.sight(self.map, self._snakes.values()),
+                    "sight": snake.sight(self.map, self._occupancy),
                     "score": snake.score,
                     "range": snake.range,
                     "traverse": snake._traverse,
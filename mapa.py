@@ -7,6 +7,58 @@ from consts import Direction, Tiles, VITAL_SPACE, NEST_SIZE
 logger = logging.getLogger("Map")
 logger.setLevel(logging.DEBUG)
 
+
+def disc_offsets(size):
+    """(dx, dy) offsets of the cells within distance size, in row order"""
+    return [
+        (dx, dy)
+        for dx in range(-size, size + 1)
+        for dy in range(-size, size + 1)
+        if math.dist((0, 0), (dx, dy)) <= size
+    ]
+
+
+# snakes' range is kept between 2 and 6, so their sight discs are computed once
+SIGHT_OFFSETS = {size: disc_offsets(size) for size in range(2, 7)}
+
+
+class CellIndex:
+    """Set of cells with O(1) add, discard and random choice.
+
+    Cells are kept in a list plus a cell -> position index; removing swaps the
+    last cell into the freed slot.
+    """
+
+    def __init__(self, cells=()):
+        self._cells = []
+        self._index = {}
+        for cell in cells:
+            self.add(cell)
+
+    def add(self, cell):
+        if cell not in self._index:
+            self._index[cell] = len(self._cells)
+            self._cells.append(cell)
+
+    def discard(self, cell):
+        i = self._index.pop(cell, None)
+        if i is None:
+            return
+        last = self._cells.pop()
+        if i < len(self._cells):
+            self._cells[i] = last
+            self._index[last] = i
+
+    def choice(self):
+        return random.choice(self._cells)
+
+    def __contains__(self, cell):
+        return cell in self._index
+
+    def __len__(self):
+        return len(self._cells)
+
+
 class Map:
     def __init__(
         self,
@@ -20,8 +72,9 @@ class Map:
         self._level = level
         self._size = size
         self._stones = []
-        self._food = []
+        self._food = {}  # ordered set of food positions
         self._snake_nests = []
+        self._occupied = set()  # cells with a snake on them (see occupy/vacate)
 
         if not mapa:
             logger.info("Generating a MAP")
@@ -48,6 +101,14 @@ class Map:
             logger.info("Loading MAP")
             self.map = mapa
 
+        # cells where food can spawn: passages without food or snakes
+        self._free = CellIndex(
+            (x, y)
+            for x in range(self.hor_tiles)
+            for y in range(self.ver_tiles)
+            if self.map[x][y] == Tiles.PASSAGE
+        )
+
     @property
     def food(self):
         return [(x, y, self.map[x][y].name) for x, y in self._food]
@@ -62,22 +123,36 @@ class Map:
         return x, y
 
     def spawn_food(self, food_type=Tiles.FOOD):
-        x = random.randint(0, self.hor_tiles - 1)
-        y = random.randint(0, self.ver_tiles - 1)
-        while (x, y) in self._food or (x, y) in self._stones:
-            x = random.randint(0, self.hor_tiles - 1)
-            y = random.randint(0, self.ver_tiles - 1)
+        if not self._free:
+            logger.warning("No free cell to spawn food")
+            return
+        x, y = self._free.choice()
+        self._free.discard((x, y))
         self.map[x][y] = food_type
-        self._food.append((x, y))
-        logger.debug("Food spawned at %s", self._food[-1])
+        self._food[(x, y)] = None
+        logger.debug("Food spawned at %s", (x, y))
 
     def eat_food(self, pos):
         x, y = pos
         old = self.map[x][y]
         self.map[x][y] = Tiles.PASSAGE
-        self._food.remove((x, y))
+        del self._food[(x, y)]
+        if pos not in self._occupied:
+            self._free.add(pos)
         return old
 
+    def occupy(self, pos):
+        """A snake moved onto pos (called by the game's occupancy grid)"""
+        self._occupied.add(pos)
+        self._free.discard(pos)
+
+    def vacate(self, pos):
+        """The last snake on pos left it (called by the game's occupancy grid)"""
+        self._occupied.discard(pos)
+        x, y = pos
+        if self.map[x][y] == Tiles.PASSAGE:
+            self._free.add(pos)
+
     @property
     def hor_tiles(self):
         return self.size[0]
@@ -108,17 +183,24 @@ class Map:
         x, y = pos
         return self.map[x][y]
 
-    def get_zone(self, pos: tuple[int, int], size: int):
+    def get_zone(self, pos: tuple[int, int], size: int, occupied=None):
+        """Tiles within distance size of pos, as {x: {y: tile}}.
+
+        Cells in occupied (anything supporting `in`, e.g. the game's occupancy
+        grid) are marked as Tiles.SNAKE.
+        """
         zone: dict[int, dict[int, Tiles]] = {}
         x, y = pos
-        for i in range(x - size, x + size + 1):
-            for j in range(y - size, y + size + 1):
-                if math.dist((x, y), (i, j)) <= size:
-                    ii = i % self.hor_tiles
-                    jj = j % self.ver_tiles
-                    if ii not in zone:
-                        zone[ii] = {}
-                    zone[ii][jj] = self.map[ii][jj]
+        offsets = SIGHT_OFFSETS.get(size) or disc_offsets(size)
+        for dx, dy in offsets:
+            ii = (x + dx) % self.hor_tiles
+            jj = (y + dy) % self.ver_tiles
+            if ii not in zone:
+                zone[ii] = {}
+            if occupied is not None and (ii, jj) in occupied:
+                zone[ii][jj] = Tiles.SNAKE
+            else:
+                zone[ii][jj] = self.map[ii][jj]
 
         return zone
 
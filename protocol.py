@@ -0,0 +1,294 @@
+"""Compact delta protocol for player and viewer streams.
+
+Clients opt in by joining with {"cmd": "join", ..., "protocol": "delta"}.
+Control messages (game info, highscores) stay JSON text frames; game frames
+are binary:
+
+    K + JSON         keyframe, the full frame as in the JSON protocol
+    D + PLAYER_DELTA player frame: new head, tail cells popped, changed sight cells
+    V + VIEWER_DELTA viewer frame: per snake new head and tail pops, food changes
+
+A keyframe is sent first, every KEYFRAME_INTERVAL ticks and whenever a client
+missed a frame, so the size of a delta does not depend on the snakes' length.
+Viewer frames carry no sight.
+"""
+import json
+import struct
+from datetime import datetime
+from typing import Callable
+
+from consts import Tiles
+
+PROTOCOLS = ("json", "delta")
+KEYFRAME_INTERVAL = 100
+
+KEYFRAME = b"K"
+PLAYER_DELTA = b"D"
+VIEWER_DELTA = b"V"
+
+# tag, step, ts, score, range, flags, head x, head y, tail pops, changed cells
+PLAYER_HEADER = struct.Struct("<cIdiBBHHBH")
+# tag, step, snakes, changed food cells
+VIEWER_HEADER = struct.Struct("<cIBH")
+# players index, flags, head x, head y, tail pops, score, range
+VIEWER_SNAKE = struct.Struct("<BBHHBiB")
+# x, y, tile (REMOVED when the cell left the sight / the food was eaten)
+CELL = struct.Struct("<HHB")
+REMOVED = 0xFF
+
+ALIVE = 1
+TRAVERSE = 2
+MOVED = 4
+
+
+def body_delta(previous: list, body: list) -> tuple[bool, int] | None:
+    """(moved, tail pops) turning previous into body (both head first), None if it can't"""
+    if not body or not previous:
+        return None
+    moved = tuple(body[0]) != tuple(previous[0])
+    pops = len(previous) + moved - len(body)
+    if not 0 <= pops <= 0xFF or tuple(body[-1]) != tuple(previous[len(previous) - 1 - pops]):
+        return None
+    return moved, pops
+
+
+def cell_changes(previous: dict, current: dict) -> list[tuple[int, int, int]]:
+    """Cells of current ({(x, y): tile}) that differ from previous, removed ones as REMOVED"""
+    changes = [(x, y, tile) for (x, y), tile in current.items() if previous.get((x, y)) != tile]
+    changes.extend((x, y, REMOVED) for x, y in previous.keys() - current.keys())
+    return changes
+
+
+def flat_sight(sight: dict) -> dict:
+    return {(int(x), int(y)): int(tile) for x, cols in sight.items() for y, tile in cols.items()}
+
+
+class PlayerEncoder:
+    """Encodes the frames of one player, relative to the last one it encoded."""
+
+    def __init__(self, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self._body = None
+        self._sight = None
+        self._ticks = 0
+
+    def reset(self):
+        """Next frame is a keyframe"""
+        self._body = None
+
+    def encode(self, step: int, ts: float, snake: dict | None, keyframe: Callable[[], str]) -> bytes:
+        """Frame for the player's snake (None if dead), keyframe() gives its JSON message"""
+        delta = None
+        if snake is not None and self._body is not None and self._ticks < self.keyframe_interval:
+            delta = body_delta(self._body, snake["body"])
+
+        if delta is None:
+            if snake is None:
+                self.reset()
+            else:
+                self._body, self._sight = snake["body"], flat_sight(snake["sight"])
+            self._ticks = 0
+            return KEYFRAME + keyframe().encode()
+
+        moved, pops = delta
+        sight = flat_sight(snake["sight"])
+        changes = cell_changes(self._sight, sight)
+        self._body, self._sight = snake["body"], sight
+        self._ticks += 1
+
+        head_x, head_y = snake["body"][0]
+        flags = (TRAVERSE if snake["traverse"] else 0) | (MOVED if moved else 0)
+        header = PLAYER_HEADER.pack(
+            PLAYER_DELTA, step, ts, snake["score"], snake["range"], flags,
+            head_x, head_y, pops, len(changes),
+        )
+        return header + b"".join(CELL.pack(*change) for change in changes)
+
+
+class ViewerEncoder:
+    """Encodes each viewer frame once, for every viewer.
+
+    After update(state), delta holds the frame relative to the previous state
+    (None when a keyframe is due) and keyframe() the full frame.
+    """
+
+    def __init__(self, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.delta = None
+        self._state = None
+        self._keyframe = None
+        self._bodies = None
+        self._food = None
+        self._ticks = 0
+
+    def update(self, state: dict):
+        snakes = {snake["name"]: snake for snake in state["snakes"]}
+        food = {(x, y): Tiles[kind] for x, y, kind in state["food"]}
+
+        self.delta = None
+        if self._bodies is not None and self._ticks < self.keyframe_interval:
+            self.delta = self._encode_delta(state, snakes, food)
+
+        self._state = state
+        self._keyframe = None
+        self._bodies = {name: snake["body"] for name, snake in snakes.items()}
+        self._food = food
+        self._ticks = self._ticks + 1 if self.delta is not None else 0
+
+    def _encode_delta(self, state, snakes, food) -> bytes | None:
+        entries = []
+        for index, name in enumerate(state["players"]):
+            if name not in self._bodies:
+                if name in snakes:
+                    return None  # a snake we never sent
+                continue
+            if name not in snakes:
+                entries.append(VIEWER_SNAKE.pack(index, 0, 0, 0, 0, 0, 0))
+                continue
+            snake = snakes[name]
+            delta = body_delta(self._bodies[name], snake["body"])
+            if delta is None:
+                return None
+            moved, pops = delta
+            head_x, head_y = snake["body"][0]
+            flags = ALIVE | (TRAVERSE if snake["traverse"] else 0) | (MOVED if moved else 0)
+            entries.append(
+                VIEWER_SNAKE.pack(index, flags, head_x, head_y, pops, snake["score"], snake["range"])
+            )
+
+        changes = cell_changes(self._food, food)
+        return (
+            VIEWER_HEADER.pack(VIEWER_DELTA, state["step"], len(entries), len(changes))
+            + b"".join(entries)
+            + b"".join(CELL.pack(*change) for change in changes)
+        )
+
+    def keyframe(self) -> bytes:
+        if self._keyframe is None:
+            state = self._state
+            self._keyframe = KEYFRAME + json.dumps(
+                {
+                    "players": state["players"],
+                    "step": state["step"],
+                    "timeout": state["timeout"],
+                    "food": state["food"],
+                    "snakes": [
+                        {key: value for key, value in snake.items() if key != "sight"}
+                        for snake in state["snakes"]
+                    ],
+                }
+            ).encode()
+        return self._keyframe
+
+
+def apply_body(body: list, flags: int, head_x: int, head_y: int, pops: int):
+    """Updates body (head first, in place) with a head move and tail pops"""
+    if flags & MOVED:
+        body.insert(0, [head_x, head_y])
+    if pops:
+        del body[-pops:]
+
+
+class PlayerDecoder:
+    """Rebuilds the JSON protocol messages from a player stream (either protocol).
+
+    Returned messages are copies, later frames do not change them.
+    """
+
+    def __init__(self):
+        self._state = None
+
+    def decode(self, message: str | bytes) -> dict:
+        if isinstance(message, str):
+            return json.loads(message)
+
+        tag = message[:1]
+        if tag == KEYFRAME:
+            state = json.loads(message[1:])
+            if "sight" in state:
+                state["sight"] = {
+                    int(x): {int(y): tile for y, tile in cols.items()}
+                    for x, cols in state["sight"].items()
+                }
+            self._state = state
+            return self._message()
+
+        if tag != PLAYER_DELTA or self._state is None:
+            raise ValueError(f"Unexpected frame {tag!r}")
+
+        (_, step, ts, score, snake_range, flags, head_x, head_y, pops, changes) = (
+            PLAYER_HEADER.unpack_from(message)
+        )
+        state = self._state
+        state["step"] = step
+        state["ts"] = datetime.fromtimestamp(ts).isoformat()
+        state["score"] = score
+        state["range"] = snake_range
+        state["traverse"] = bool(flags & TRAVERSE)
+        apply_body(state["body"], flags, head_x, head_y, pops)
+
+        sight = state["sight"]
+        for x, y, tile in CELL.iter_unpack(message[PLAYER_HEADER.size :]):
+            if tile == REMOVED:
+                del sight[x][y]
+                if not sight[x]:
+                    del sight[x]
+            else:
+                sight.setdefault(x, {})[y] = tile
+        return self._message()
+
+    def _message(self) -> dict:
+        message = dict(self._state)
+        if "body" in message:
+            message["body"] = list(message["body"])
+            message["sight"] = {x: dict(cols) for x, cols in message["sight"].items()}
+        return message
+
+
+class ViewerDecoder:
+    """Rebuilds the JSON protocol messages (without sight) from a viewer stream."""
+
+    def __init__(self):
+        self._state = None
+
+    def decode(self, message: str | bytes) -> dict:
+        if isinstance(message, str):
+            return json.loads(message)
+
+        tag = message[:1]
+        if tag == KEYFRAME:
+            self._state = json.loads(message[1:])
+            return dict(self._state)
+
+        if tag != VIEWER_DELTA or self._state is None:
+            raise ValueError(f"Unexpected frame {tag!r}")
+
+        _, step, snakes, changes = VIEWER_HEADER.unpack_from(message)
+        state = self._state
+        state["step"] = step
+
+        by_name = {snake["name"]: snake for snake in state["snakes"]}
+        offset = VIEWER_HEADER.size
+        for _ in range(snakes):
+            index, flags, head_x, head_y, pops, score, snake_range = VIEWER_SNAKE.unpack_from(
+                message, offset
+            )
+            offset += VIEWER_SNAKE.size
+            snake = by_name[state["players"][index]]
+            if not flags & ALIVE:
+                state["snakes"].remove(snake)
+                continue
+            apply_body(snake["body"], flags, head_x, head_y, pops)
+            snake["score"] = score
+            snake["range"] = snake_range
+            snake["traverse"] = bool(flags & TRAVERSE)
+
+        if changes:
+            food = {(x, y): kind for x, y, kind in state["food"]}
+            for x, y, tile in CELL.iter_unpack(message[offset:]):
+                if tile == REMOVED:
+                    del food[(x, y)]
+                else:
+                    food[(x, y)] = Tiles(tile).name
+            state["food"] = [[x, y, kind] for (x, y), kind in food.items()]
+        return dict(state)
@@ -5,9 +5,13 @@ import asyncio
 from datetime import datetime
 import json
 import logging
+import multiprocessing
 import os.path
 import random
-from collections import namedtuple
+import tempfile
+import time
+import zlib
+from collections import deque, namedtuple
 from typing import Any, Dict, Set
 
 import requests
@@ -17,6 +21,27 @@ from websockets.legacy.protocol import WebSocketCommonProtocol
 
 from game import Game
 from consts import TIMEOUT
+from protocol import PROTOCOLS, PlayerEncoder, ViewerEncoder
+
+try:
+    import orjson
+
+    def dumps(obj: Any) -> str:
+        """Encode obj as JSON (sight maps have int keys, as with the json module)."""
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+except ImportError:
+
+    def dumps(obj: Any) -> str:
+        """Encode obj as JSON."""
+        return json.dumps(obj, separators=(",", ":"))
+
+
+def splice(shared: str, private: str) -> str:
+    """Merge two JSON objects encoded by dumps, without decoding them."""
+    if private == "{}":
+        return shared
+    return shared[:-1] + "," + private[1:]
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -32,133 +57,370 @@ Player = namedtuple("Player", ["name", "ws"])
 HIGHSCORE_FILE = "highscores.json"
 MAX_HIGHSCORES = 10
 
+GRADING_OUTBOX_FILE = "grading_outbox.jsonl"
+GRADING_BATCH_SIZE = 20
+GRADING_RETRY_DELAY = 1.0  # seconds, doubled after every failure
+GRADING_MAX_RETRY_DELAY = 60.0
+GRADING_OUTBOX_MAX_RECORDS = 10000  # the oldest records are dropped beyond this
 
-class GameServer:
-    """Network Game Server."""
+# outgoing messages queued per client before it is considered too slow
+PLAYER_QUEUE_SIZE = 32  # players must get every frame, a full queue disconnects them
+VIEWER_QUEUE_SIZE = 8  # viewers only need recent frames, the oldest ones are dropped
+
+
+class SendLatency:
+    """Time from queueing a message to the client until it was sent."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def __str__(self) -> str:
+        return f"mean {self.mean * 1000:.1f}ms, max {self.max * 1000:.1f}ms over {self.count} messages"
+
+
+def write_atomic(path: str, data: str):
+    """Replace the contents of path with data, never leaving it half written."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "w") as outfile:
+        outfile.write(data)
+    os.replace(tmp_path, path)
+
+
+def append_file(path: str, data: str):
+    """Append data to path (a crash may leave the last line half written)."""
+    with open(path, "a") as outfile:
+        outfile.write(data)
+
+
+class GradingOutbox:
+    """Game records waiting to be submitted to the grading server.
+
+    Records are kept in a JSONL file, so they survive restarts, and posted by a
+    background task in batches (over one HTTP session, in a worker thread),
+    retrying with exponential backoff while the grading server is unreachable.
+    New records are appended to the file, which is only rewritten when records
+    leave it (posted, or the oldest dropped beyond max_records).
+    """
 
     def __init__(
         self,
-        level: int,
-        timeout: int,
-        seed: int = 0,
-        players=1,
-        grading: str = None,
-        dbg: bool = False,
+        url: str,
+        path: str = GRADING_OUTBOX_FILE,
+        max_records: int = GRADING_OUTBOX_MAX_RECORDS,
     ):
-        """Initialize Gameserver."""
-        self.dbg = dbg
-        self.seed = seed
-        self.game = Game(timeout=timeout)
-        self.players: asyncio.Queue[Player] = asyncio.Queue()
-        self.viewers: Set[WebSocketCommonProtocol] = set()
-        self.grading = grading
-        self._level = level  # game level
-        self._timeout = timeout  # timeout for game
-        self.game_player = {}  # websocket to player mapping
-        self.number_of_players = players
+        self.url = url
+        self.path = path
+        self.max_records = max_records
+        self._pending = []
+        if os.path.isfile(path):
+            with open(path, "r") as infile:
+                for line in infile:
+                    try:
+                        self._pending.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        if line.strip():
+                            logger.warning("Skipping broken grading record: %r", line)
+            self._trim()
+        self._wakeup = asyncio.Event()
+        self._writing = asyncio.Lock()  # so an append is never overwritten by an older rewrite
+        self._session = requests.Session()
+
+    async def put(self, records):
+        self._pending.extend(records)
+        if self._trim():
+            await self._save()
+        else:
+            data = "".join(json.dumps(record) + "\n" for record in records)
+            async with self._writing:
+                await asyncio.to_thread(append_file, self.path, data)
+        self._wakeup.set()
+
+    def _trim(self) -> bool:
+        """Drop the oldest records beyond max_records, returns whether any was dropped."""
+        excess = len(self._pending) - self.max_records
+        if excess <= 0:
+            return False
+        logger.warning(
+            "Grading outbox is full (%s records), dropping the %s oldest",
+            self.max_records,
+            excess,
+        )
+        del self._pending[:excess]
+        return True
+
+    async def _save(self):
+        async with self._writing:
+            data = "".join(json.dumps(record) + "\n" for record in self._pending)
+            await asyncio.to_thread(write_atomic, self.path, data)
+
+    def _post(self, batch) -> int:
+        """Post the records of batch in order, returns how many were dealt with."""
+        for done, record in enumerate(batch):
+            try:
+                response = self._session.post(self.url, json=record, timeout=2)
+            except RequestException as err:
+                logger.warning("Could not save score to server: %s", err)
+                return done
+            if response.status_code >= 500:
+                logger.warning("Grading server error %s, will retry", response.status_code)
+                return done
+            if response.status_code >= 400:
+                logger.error("Grading server rejected %s: %s", record, response.status_code)
+        return len(batch)
+
+    async def run(self):
+        if self._pending:
+            self._wakeup.set()
+        delay = GRADING_RETRY_DELAY
+        while True:
+            await self._wakeup.wait()
+            while self._pending:
+                batch = self._pending[:GRADING_BATCH_SIZE]
+                done = await asyncio.to_thread(self._post, batch)
+                if done:
+                    # by identity, put may have dropped some while posting
+                    sent = {id(record) for record in batch[:done]}
+                    self._pending = [r for r in self._pending if id(r) not in sent]
+                    await self._save()
+                if done < len(batch):
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, GRADING_MAX_RETRY_DELAY)
+                else:
+                    delay = GRADING_RETRY_DELAY
+            self._wakeup.clear()
+
+
+class ClientChannel:
+    """Outgoing side of a client connection.
+
+    Messages go through a bounded queue drained by a task of its own, so a slow
+    client never delays the game loop or the other clients. Only game frames
+    are ever dropped, control messages (game info, highscores) are always kept.
+    On the delta protocol frames depend on the previous ones, so instead of
+    dropping the oldest frame every queued frame is dropped and the client is
+    due a keyframe.
+    """
 
-        self._highscores = []
-        if os.path.isfile(HIGHSCORE_FILE):
-            with open(HIGHSCORE_FILE, "r") as infile:
-                self._highscores = json.load(infile)
+    def __init__(
+        self,
+        ws: WebSocketCommonProtocol,
+        maxsize: int,
+        drop_oldest: bool,
+        protocol: str = "json",
+    ):
+        self.ws = ws
+        self.latency = SendLatency()
+        self.dropped = 0
+        self.closed = False
+        self.delta = protocol == "delta"
+        self.needs_keyframe = True
+        self.encoder = None  # players' PlayerEncoder, on the delta protocol
+        self._drop_oldest = drop_oldest
+        self._maxsize = maxsize
+        self._queue: deque = deque()  # (message, queued at, is a frame)
+        self._queued = asyncio.Event()
+        self._sent = asyncio.Event()  # set while nothing is queued nor being sent
+        self._sent.set()
+        self._sender = asyncio.ensure_future(self._send_loop())
+
+    def push(self, message, frame: bool = True) -> bool:
+        """Queue a message, returns False if the client is gone or fell too far behind.
+
+        Control messages (frame=False) are queued even when the queue is full.
+        """
+        if self.closed:
+            return False
+        if frame and len(self._queue) >= self._maxsize:
+            if not self._drop_oldest:
+                logger.warning("Client queue is full (%s messages)", len(self._queue))
+                return False
+            if self.delta:
+                kept = deque(item for item in self._queue if not item[2])
+                self.dropped += len(self._queue) - len(kept) + 1
+                self._queue = kept
+                self.needs_keyframe = True
+                return True
+            for item in self._queue:
+                if item[2]:
+                    self._queue.remove(item)
+                    self.dropped += 1
+                    break
+        self._queue.append((message, time.monotonic(), frame))
+        self._sent.clear()
+        self._queued.set()
+        return True
+
+    async def _send_loop(self):
+        try:
+            while True:
+                if not self._queue:
+                    self._sent.set()
+                    self._queued.clear()
+                    await self._queued.wait()
+                    continue
+                message, queued_at, _ = self._queue.popleft()
+                await self.ws.send(message)
+                self.latency.add(time.monotonic() - queued_at)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            self._sent.set()
+
+    async def flush(self, timeout: float = 1.0):
+        """Wait (up to timeout seconds) until every queued message was sent."""
+        try:
+            await asyncio.wait_for(self._sent.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Gave up flushing %s messages", len(self._queue))
 
-    def save_highscores(self):
-        """Update highscores, storing to file."""
+    async def close(self):
+        self._sender.cancel()
+        self.closed = True
+        await self.ws.close()
 
-        logger.debug("Save highscores")
-        for player in self.game_player.values():
-            if player not in self.game.snakes:
-                continue
-            logger.info(
-                "Saving: %s <%s>",
-                player,
-                self.game.snakes[player].score,
-            )
 
-            self._highscores.append((player, self.game.snakes[player].score))
-            self._highscores = sorted(
-                self._highscores, key=lambda s: s[1], reverse=True
-            )[:MAX_HIGHSCORES]
+DEFAULT_ROOM = "default"
 
-        with open(HIGHSCORE_FILE, "w") as outfile:
-            json.dump(self._highscores, outfile)
 
-        return self._highscores
+def shard_port(room: str, port: int, shards: int) -> int:
+    """Port of the server process hosting room, when rooms are sharded over processes."""
+    return port + zlib.crc32(room.encode()) % shards
+
+
+class Room:
+    """Players joining with the same room key play together, one game at a time.
+
+    Each room has its own game, tick task, players and viewers.
+    """
+
+    def __init__(self, server: GameServer, name: str):
+        self.server = server
+        self.name = name
+        self.game = Game(timeout=server._timeout)
+        self.players: asyncio.Queue[Player] = asyncio.Queue()
+        self.viewers: Set[WebSocketCommonProtocol] = set()
+        self.channels: Dict[WebSocketCommonProtocol, ClientChannel] = {}
+        self.viewer_encoder = ViewerEncoder()
+        self.game_player = {}  # websocket to player mapping
+        self.playing = False
+        self.task = asyncio.ensure_future(self.mainloop())
+
+    @property
+    def idle(self) -> bool:
+        return (
+            not self.playing
+            and self.players.empty()
+            and not self.viewers
+            and not self.game_player
+        )
+
+    async def join_player(self, websocket: WebSocketCommonProtocol, name: str, protocol: str):
+        if name in self.game_player.values():
+            logger.error("Player <%s> already exists in room <%s>", name, self.name)
+            await websocket.close()
+            return
+        logger.info("<%s> has joined room <%s>", name, self.name)
+        self.channels[websocket] = ClientChannel(
+            websocket, PLAYER_QUEUE_SIZE, drop_oldest=False, protocol=protocol
+        )
+        if protocol == "delta":
+            self.channels[websocket].encoder = PlayerEncoder()
+        await self.players.put(Player(name, websocket))
+        self.game_player[websocket] = name
+
+    def join_viewer(self, websocket: WebSocketCommonProtocol, protocol: str):
+        logger.info("Viewer connected to room <%s>", self.name)
+        self.channels[websocket] = ClientChannel(
+            websocket, VIEWER_QUEUE_SIZE, drop_oldest=True, protocol=protocol
+        )
+        self.viewers.add(websocket)
 
     async def send_clients(self, group, info):
+        """Queue a control message to every client in group (never dropped, all are sent concurrently)."""
         to_remove = []
 
-        original_group = group
-        if isinstance(group, dict):
-            group = group.keys()
-
+        message = dumps(info)
         for client in group:
-            try:
-                await client.send(json.dumps(info))
-            except Exception:
+            if not self.channels[client].push(message, frame=False):
                 to_remove.append(client)
-                await client.close()
-        for client in to_remove:
-            if isinstance(original_group, dict):
-                del original_group[client]        
-            else:
-                original_group.remove(client)
+        await self.remove_clients(group, to_remove)
 
-    async def incomming_handler(self, websocket: WebSocketCommonProtocol, path: str):
-        """Process new clients arriving at the server."""
-        try:
-            async for message in websocket:
-                data = json.loads(message)
-                if "cmd" not in data:
-                    continue
-                if data["cmd"] == "join":
-                    if path == "/player":
-                        if data["name"] in self.game_player.values():
-                            logger.error("Player <%s> already exists", data["name"])
-                            await websocket.close()
-                            continue
-                        logger.info("<%s> has joined", data["name"])
-                        await self.players.put(Player(data["name"], websocket))
-                        self.game_player[websocket] = data["name"]
+    async def send_viewers_frame(self, state):
+        """Queue a game frame to every viewer, in the protocol it joined with."""
+        to_remove = []
 
-                    if path == "/viewer":
-                        logger.info("Viewer connected")
-                        self.viewers.add(websocket)
+        self.viewer_encoder.update(state)
+        json_message = None
+        for client in self.viewers:
+            channel = self.channels[client]
+            if not channel.delta:
+                if json_message is None:
+                    json_message = dumps(state)
+                message = json_message
+            elif channel.needs_keyframe or self.viewer_encoder.delta is None:
+                channel.needs_keyframe = False
+                message = self.viewer_encoder.keyframe()
+            else:
+                message = self.viewer_encoder.delta
+            if not channel.push(message):
+                to_remove.append(client)
+        await self.remove_clients(self.viewers, to_remove)
 
-                    if self.game.running:
-                        game_info = self.game.info()
-                        await websocket.send(json.dumps(game_info))
+    async def remove_clients(self, group, to_remove):
+        for client in to_remove:
+            await self.channels.pop(client).close()
+            if isinstance(group, dict):
+                del group[client]
+            else:
+                group.remove(client)
 
-                if data["cmd"] == "key":
-                    logger.debug((self.game_player[websocket], data))
-                    if len(data["key"]) > 0:
-                        self.game.keypress(self.game_player[websocket], data["key"][0])
-                    else:
-                        self.game.keypress(self.game_player[websocket], "")
+    async def flush_clients(self, group):
+        """Wait until the messages queued to the clients in group were sent."""
+        await asyncio.gather(
+            *(self.channels[client].flush() for client in group if client in self.channels)
+        )
 
-        except websockets.exceptions.ConnectionClosed as closed_reason:
-            logger.info("Client disconnected: %s", closed_reason)
-            if websocket in self.viewers:
-                self.viewers.remove(websocket)
+    def log_send_latency(self):
+        for ws, channel in self.channels.items():
+            logger.info(
+                "Send latency to <%s>: %s (%s dropped)",
+                self.game_player.get(ws, "viewer"),
+                channel.latency,
+                channel.dropped,
+            )
 
     async def mainloop(self):
-        """Run the game."""
+        """Run the room's games, until it is left idle (the default room never is)."""
         while True:
             game_players = []
-            logger.info("Waiting for players")
-            while len(game_players) < self.number_of_players:
+            logger.info("Room <%s> waiting for players", self.name)
+            while len(game_players) < self.server.number_of_players:
                 game_players.append(await self.players.get())
 
                 if game_players[-1].ws.closed:
                     logger.error("<%s> disconnect while waiting", game_players[-1].name)
                     continue
 
+            self.playing = True
             try:
-                logger.info("Starting game")
-                if self.seed > 0:
-                    random.seed(self.seed)
+                logger.info("Starting game in room <%s>", self.name)
+                if self.server.seed > 0:
+                    random.seed(self.server.seed)
 
-                self.game = Game(timeout=self._timeout)
+                self.game = Game(timeout=self.server._timeout, throttled=self.server.throttled)
+                self.viewer_encoder = ViewerEncoder()
                 self.game.start([p.name for p in game_players])
 
                 while self.game.running:
@@ -169,36 +431,56 @@ class GameServer:
                         await self.send_clients(self.game_player, game_info)
 
                     if state := await self.game.next_frame():
-                        await self.send_clients(self.viewers, state)
-
-                        snakes = state["snakes"]
-                        del state[
-                            "snakes"
-                        ]  # remove snakes from state as we only send our snake sight
-                        del state[
-                            "food"
-                        ]  # remove food from state as we only send our snake sight
-
-                        for player in game_players:
-                            state["ts"] = datetime.now().isoformat()
-                            for player_snake in snakes:
-                                if player_snake["name"] == player.name:
-                                    state = {**state, **player_snake}
-                            try:
-                                await player.ws.send(json.dumps(state))
-                            except Exception as e:
+                        await self.send_viewers_frame(state)
+
+                        # players only get their own snake (and its sight), the rest
+                        # of the frame is the same for everyone and encoded once
+                        snakes = {snake["name"]: snake for snake in state["snakes"]}
+                        now = datetime.now()
+                        shared = dumps(
+                            {
+                                "players": state["players"],
+                                "step": state["step"],
+                                "timeout": state["timeout"],
+                                "ts": now.isoformat(),
+                            }
+                        )
+
+                        def player_message(snake):
+                            return shared if snake is None else splice(shared, dumps(snake))
+
+                        for player in list(game_players):
+                            snake = snakes.get(player.name)
+                            channel = self.channels.get(player.ws)
+                            if channel is None:
+                                message = None
+                            elif channel.encoder is not None:
+                                message = channel.encoder.encode(
+                                    state["step"],
+                                    now.timestamp(),
+                                    snake,
+                                    lambda: player_message(snake),
+                                )
+                            else:
+                                message = player_message(snake)
+                            if message is None or not channel.push(message):
                                 logger.error(
                                     "Player <%s> disconnected, could not send state",
                                     player.name,
                                 )
                                 game_players.remove(player)
 
-                game_over = {"highscores": self.save_highscores()}
+                highscores = await self.server.save_highscores(
+                    self.game, self.game_player.values()
+                )
+                game_over = {"highscores": highscores}
                 await self.send_clients(self.viewers, game_over)
                 await self.send_clients(self.game_player, game_over)
+                await self.flush_clients(self.game_player)
+                self.log_send_latency()
 
                 for ws, player in self.game_player.items():
-                    await ws.close()
+                    await self.channels.pop(ws).close()
                 self.game_player = {}
 
             except websockets.exceptions.ConnectionClosed as ws_closed:
@@ -206,23 +488,193 @@ class GameServer:
                     self.game_player.pop(ws_closed)
                 logger.error("Player disconnected: %s", ws_closed)
             finally:
-                try:
-                    if self.grading:
-                        for player in game_players:
-                            game_record = {
+                if self.server.grading_outbox is not None:
+                    await self.server.grading_outbox.put(
+                        [
+                            {
                                 "player": player.name,
                                 "score": self.game.snakes[player.name].score,
-                                "players": self.number_of_players, 
+                                "players": self.server.number_of_players,
                             }
-                            requests.post(self.grading, json=game_record, timeout=2)
-                except RequestException as err:
-                    logger.error(err)
-                    logger.warning("Could not save score to server")
+                            for player in game_players
+                        ]
+                    )
 
                 for ws, player in self.game_player.items():
                     logger.info("Disconnecting <%s>", player)
-                    await ws.close()
+                    channel = self.channels.pop(ws, None)
+                    if channel is not None:
+                        await channel.close()
+                    else:
+                        await ws.close()
                 self.game_player = {}
+                self.playing = False
+
+            if self.name != DEFAULT_ROOM and self.idle:
+                self.server.close_room(self)
+                return
+
+
+class GameServer:
+    """Network Game Server."""
+
+    def __init__(
+        self,
+        level: int,
+        timeout: int,
+        seed: int = 0,
+        players=1,
+        grading: str = None,
+        dbg: bool = False,
+        throttled: bool = True,
+        highscore_file: str = HIGHSCORE_FILE,
+        grading_outbox_file: str = GRADING_OUTBOX_FILE,
+    ):
+        """Initialize Gameserver."""
+        self.dbg = dbg
+        self.seed = seed
+        self.throttled = throttled
+        self.rooms: Dict[str, Room] = {}
+        self.client_room: Dict[WebSocketCommonProtocol, Room] = {}
+        self.grading = grading
+        self.grading_outbox = (
+            GradingOutbox(grading, grading_outbox_file) if grading else None
+        )
+        self._level = level  # game level
+        self._timeout = timeout  # timeout for game
+        self.number_of_players = players
+
+        self.highscore_file = highscore_file
+        self._highscores = []
+        if os.path.isfile(highscore_file):
+            with open(highscore_file, "r") as infile:
+                self._highscores = json.load(infile)
+        # rooms may finish at once, the file is written by one of them at a time
+        self._highscores_writing = asyncio.Lock()
+
+    def room(self, name: str) -> Room:
+        """The room with the given key, opening it if needed."""
+        if name not in self.rooms:
+            logger.info("Opening room <%s>", name)
+            self.rooms[name] = Room(self, name)
+        return self.rooms[name]
+
+    def close_room(self, room: Room):
+        if self.rooms.get(room.name) is room:
+            logger.info("Closing room <%s>", room.name)
+            del self.rooms[room.name]
+
+    async def save_highscores(self, game: Game, players):
+        """Update highscores, storing to file (from a worker thread)."""
+
+        logger.debug("Save highscores")
+        for player in players:
+            if player not in game.snakes:
+                continue
+            logger.info(
+                "Saving: %s <%s>",
+                player,
+                game.snakes[player].score,
+            )
+
+            self._highscores.append((player, game.snakes[player].score))
+
+        self._highscores = sorted(
+            self._highscores, key=lambda s: s[1], reverse=True
+        )[:MAX_HIGHSCORES]
+
+        highscores = self._highscores
+        async with self._highscores_writing:
+            # the latest highscores, so a newer snapshot is never overwritten by an older one
+            await asyncio.to_thread(
+                write_atomic, self.highscore_file, json.dumps(self._highscores)
+            )
+
+        return highscores
+
+    async def incomming_handler(self, websocket: WebSocketCommonProtocol, path: str):
+        """Process new clients arriving at the server."""
+        try:
+            async for message in websocket:
+                data = json.loads(message)
+                if "cmd" not in data:
+                    continue
+                if data["cmd"] == "join":
+                    protocol = data.get("protocol", "json")
+                    if protocol not in PROTOCOLS:
+                        logger.warning("Unknown protocol <%s>, using json", protocol)
+                        protocol = "json"
+
+                    room = self.room(str(data.get("room", DEFAULT_ROOM)))
+                    self.client_room[websocket] = room
+                    if path == "/player":
+                        await room.join_player(websocket, data["name"], protocol)
+
+                    if path == "/viewer":
+                        room.join_viewer(websocket, protocol)
+
+                    if room.game.running and websocket in room.channels:
+                        game_info = room.game.info()
+                        room.channels[websocket].push(dumps(game_info), frame=False)
+
+                if data["cmd"] == "key" and websocket in self.client_room:
+                    room = self.client_room[websocket]
+                    logger.debug((room.game_player[websocket], data))
+                    if len(data["key"]) > 0:
+                        room.game.keypress(room.game_player[websocket], data["key"][0])
+                    else:
+                        room.game.keypress(room.game_player[websocket], "")
+
+        except websockets.exceptions.ConnectionClosed as closed_reason:
+            logger.info("Client disconnected: %s", closed_reason)
+        finally:
+            room = self.client_room.pop(websocket, None)
+            if room is not None and websocket in room.viewers:
+                room.viewers.remove(websocket)
+                await room.channels.pop(websocket).close()
+            if room is not None and room.name != DEFAULT_ROOM and room.idle:
+                room.task.cancel()  # nobody left waiting for a game in it
+                self.close_room(room)
+
+    async def mainloop(self):
+        """Run the games of every room."""
+        if self.grading_outbox is not None:
+            asyncio.ensure_future(self.grading_outbox.run())
+
+        await self.room(DEFAULT_ROOM).task
+
+
+async def serve(args, shard: int | None = None):
+    """Start server tasks (of one shard, listening on port + shard, when sharded)."""
+    port = args.port
+    highscore_file, grading_outbox_file = HIGHSCORE_FILE, GRADING_OUTBOX_FILE
+    if shard is not None:
+        port += shard
+        highscore_file = f"highscores-{shard}.json"
+        grading_outbox_file = f"grading_outbox-{shard}.jsonl"
+
+    g = GameServer(
+        0,
+        TIMEOUT,
+        args.seed,
+        args.players,
+        args.grading_server,
+        args.debug,
+        throttled=not args.unthrottled,
+        highscore_file=highscore_file,
+        grading_outbox_file=grading_outbox_file,
+    )
+
+    game_loop_task = asyncio.ensure_future(g.mainloop())
+
+    logger.info("Listenning @ %s:%s", args.bind, port)
+    websocket_server = websockets.serve(g.incomming_handler, args.bind, port)
+
+    await asyncio.gather(websocket_server, game_loop_task)
+
+
+def run_shard(args, shard):
+    asyncio.run(serve(args, shard))
 
 
 if __name__ == "__main__":
@@ -233,7 +685,18 @@ if __name__ == "__main__":
     parser.add_argument(
         "--debug", help="Open Bitmap with map on gameover", action="store_true"
     )
-    parser.add_argument("--players", help="Number of players", type=int, default=1)
+    parser.add_argument("--players", help="Number of players per game", type=int, default=1)
+    parser.add_argument(
+        "--unthrottled",
+        help="Run ticks back to back instead of at the game speed (benchmarking)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--shards",
+        help="Spread rooms over this many processes, on ports port..port+shards-1 (see shard_port)",
+        type=int,
+        default=0,
+    )
     parser.add_argument(
         "--grading-server",
         help="url of grading server",
@@ -241,15 +704,14 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    async def main():
-        """Start server tasks."""
-        g = GameServer(0, TIMEOUT, args.seed, args.players, args.grading_server, args.debug)
-
-        game_loop_task = asyncio.ensure_future(g.mainloop())
-
-        logger.info("Listenning @ %s:%s", args.bind, args.port)
-        websocket_server = websockets.serve(g.incomming_handler, args.bind, args.port)
-
-        await asyncio.gather(websocket_server, game_loop_task)
-
-    asyncio.run(main())
\ No newline at end of file
+    if args.shards > 1:
+        processes = [
+            multiprocessing.Process(target=run_shard, args=(args, shard))
+            for shard in range(args.shards)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        asyncio.run(serve(args))
@@ -0,0 +1,171 @@
+"""Headless game runner.
+
+Plays the agent (SnakeDomain) against game.py in the same process, frame by
+frame, without websockets or sleeps. Each agent receives the same per-player
+message the server would send it.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime
+
+from consts import TIMEOUT
+from game import Game, GAME_SPEED
+from utils import trace
+from utils.snake import Snake
+from utils.SnakeDomain import SnakeDomain
+
+logger = logging.getLogger("Simulator")
+logger.setLevel(logging.INFO)
+
+
+class LocalAgent:
+    """Student agent playing in-process."""
+
+    def __init__(
+        self,
+        name: str,
+        game_info: dict,
+        seed: int | None = None,
+        config: dict | None = None,
+    ):
+        self.name = name
+        self.snake = Snake(game_info["size"])
+        self.domain = SnakeDomain(map=game_info, seed=seed)
+        for option, value in (config or {}).items():
+            if not hasattr(self.domain, option):
+                raise ValueError(f"Unknown agent option: {option}")
+            setattr(self.domain, option, value)
+        asyncio.run(self.domain.startupMap())
+
+        self.gave_up = False  # the agent raised, like student.py it stops sending keys
+        self.move_times: list[float] = []
+
+    def next_key(self, state: dict, snake_state: dict) -> str | None:
+        """Feed the agent its view of the frame and return the key it presses"""
+        if self.gave_up:
+            return None
+
+        data = {
+            "players": state["players"],
+            "step": state["step"],
+            "timeout": state["timeout"],
+            "ts": datetime.now().isoformat(),
+            **snake_state,
+            "body": [list(pos) for pos in snake_state["body"]],
+        }
+
+        start = time.perf_counter()
+        try:
+            self.snake.update(data)
+            key = self.domain.get_next_move(snake=self.snake)
+        except Exception:
+            logger.exception("Agent <%s> failed at step %s", self.name, state["step"])
+            trace.dump(f"{self.name} failed at step {state['step']}")
+            self.gave_up = True
+            return None
+        finally:
+            self.move_times.append(time.perf_counter() - start)
+
+        return key
+
+    def latency_ms(self) -> dict:
+        """Percentiles of the time the agent took per move, in milliseconds"""
+        times = sorted(self.move_times) or [0.0]
+        return {
+            f"p{q}": 1000 * times[min(len(times) - 1, len(times) * q // 100)]
+            for q in (50, 90, 99)
+        } | {"max": 1000 * times[-1]}
+
+
+def set_log_level(level):
+    """Set the level of the root, game and map loggers (the latter two set their own) and of the agent"""
+    for name in ("", "Game", "Map"):
+        logging.getLogger(name).setLevel(level)
+    trace.configure(level=level)
+
+
+def play_game(
+    seed: int = 0,
+    players=("student",),
+    timeout: int = TIMEOUT,
+    game_speed: int = GAME_SPEED,
+    config: dict | None = None,
+) -> dict:
+    """Play one full game and return its result
+
+    config optionally overrides SnakeDomain attributes of every agent.
+    """
+    if seed > 0:
+        random.seed(seed)  # same seeding as the server
+
+    game = Game(timeout=timeout, game_speed=game_speed)
+    game.start(list(players))
+    game_info = game.info()
+    agents = {
+        name: LocalAgent(name, game_info, seed=seed if seed > 0 else None, config=config)
+        for name in players
+    }
+
+    keys = {}
+    while game.running:
+        state = game.step(keys)
+        if state is None:
+            break
+
+        keys = {}
+        for snake_state in state["snakes"]:
+            key = agents[snake_state["name"]].next_key(state, snake_state)
+            if key is not None:
+                keys[snake_state["name"]] = key
+
+    results = {}
+    for name, agent in agents.items():
+        snake = game.snakes[name]
+        if not snake.alive:
+            trace.dump(f"{name} died at step {snake.death_step} ({snake.death_cause})")
+        results[name] = {
+            "score": snake.score,
+            "alive": snake.alive,
+            "steps": snake.death_step if snake.death_step is not None else game._step,
+            "death_cause": snake.death_cause,
+            "foods_eaten": snake.foods_eaten,
+            "superfoods_eaten": snake.superfoods_eaten,
+            "agent_gave_up": agent.gave_up,
+            "moves": len(agent.move_times),
+            "latency_ms": agent.latency_ms(),
+        }
+
+    return {"seed": seed, "steps": game._step, "players": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", help="Seed of the first game", type=int, default=1)
+    parser.add_argument("--games", help="Number of games (consecutive seeds)", type=int, default=1)
+    parser.add_argument("--players", help="Number of players", type=int, default=1)
+    parser.add_argument("--timeout", help="Steps per game", type=int, default=TIMEOUT)
+    parser.add_argument(
+        "--log-level",
+        help="Log level of the game and agent (see utils/trace.py for per subsystem levels)",
+        default="CRITICAL",
+    )
+    args = parser.parse_args()
+
+    set_log_level(args.log_level)
+
+    names = ["student"] + [f"student{i}" for i in range(1, args.players)]
+    scores = []
+    started = time.perf_counter()
+    for seed in range(args.seed, args.seed + args.games):
+        result = play_game(seed, names, timeout=args.timeout)
+        print(json.dumps(result))
+        scores.extend(player["score"] for player in result["players"].values())
+
+    print(
+        f"{args.games} games in {time.perf_counter() - started:.1f}s, "
+        f"average score {sum(scores) / len(scores):.2f}"
+    )
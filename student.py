@@ -2,70 +2,115 @@ import asyncio
 import datetime
 import getpass
 import json
-import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 import websockets # type: ignore
+from protocol import PlayerDecoder
+from utils import trace
 from utils.snake import Snake
 from utils.SnakeDomain import SnakeDomain
 
+client_log = trace.get_tracer("client")
+
+
+# the search is cancelled this long before the frame deadline, to still send the move in time
+SEND_MARGIN = 0.005
+
+
+async def receive_frames(websocket, decoder, frames: asyncio.Queue):
+    """Decode every frame as it arrives, keeping only the newest one in frames (None once closed)"""
+    try:
+        while True:
+            data = decoder.decode(await websocket.recv())
+            if frames.full():
+                frames.get_nowait()  # not planned in time, superseded by this one
+            frames.put_nowait(data)
+    finally:
+        if frames.full():
+            frames.get_nowait()
+        frames.put_nowait(None)
+
 
 async def agent_loop(server_address="localhost:8000", agent_name="student"):
     
     async with websockets.connect(f"ws://{server_address}/player") as websocket:
         # Receive information about static game properties
-        await websocket.send(json.dumps({"cmd": "join", "name": agent_name}))
+        await websocket.send(
+            json.dumps(
+                {"cmd": "join", "name": agent_name, "protocol": PROTOCOL, "room": ROOM}
+            )
+        )
+        decoder = PlayerDecoder()
 
         # extract the map info, first JSON received when joining the game
-        map_info = json.loads(await websocket.recv())
+        map_info = decoder.decode(await websocket.recv())
 
-        snake: Snake = Snake()
+        snake: Snake = Snake(map_info["size"])
         domain: SnakeDomain = SnakeDomain(map=map_info, seed=SEED)
         await domain.startupMap()
 
-        while True:
-            try:
-                data = json.loads(
-                    await websocket.recv()
-                )  # receive game update, this must be called timely or your game will get out of sync with the server
+        # the agent plans in a worker thread, so frames keep being received meanwhile
+        loop = asyncio.get_running_loop()
+        planner = ThreadPoolExecutor(max_workers=1)
+        frames: asyncio.Queue = asyncio.Queue(maxsize=1)
+        receiver = asyncio.ensure_future(receive_frames(websocket, decoder, frames))
+        last_step = None
 
-                ts = datetime.datetime.fromisoformat(data["ts"]).timestamp()
-                if (datetime.datetime.now().timestamp() - ts) > domain.time_per_frame:
-                    logging.error("Received a message that is too old")
-                    domain.multi_objectives.clear_goals()
-                    domain.plan = []
-                    continue
-                
-                
-                snake.update(data)
-            
+        try:
+            while (data := await frames.get()) is not None:
+                if "body" not in data:
+                    if "step" in data and last_step is not None:
+                        trace.dump(f"dead at step {data['step']}")
+                        last_step = None
+                    continue  # dead or game over
+
+                if last_step is not None and data["step"] != last_step + 1:
+                    # frames were skipped, the snake kept going without us
+                    client_log.warning("Skipped %s frames", data["step"] - last_step - 1)
+                    domain.reset_plan()
+                last_step = data["step"]
 
-                key = domain.get_next_move(snake=snake)
+                ts = datetime.datetime.fromisoformat(data["ts"]).timestamp()
+                deadline = ts + domain.time_per_frame - SEND_MARGIN
 
-                if (datetime.datetime.now().timestamp() - ts) > domain.time_per_frame:
-                    logging.error("Took too long to send message!") 
-                    domain.multi_objectives.clear_goals()
-                    domain.plan = []
-                    continue
+                snake.update(data)
+                domain.cancel.clear()
+                move = loop.run_in_executor(planner, domain.get_next_move, snake)
+                try:
+                    key = await asyncio.wait_for(
+                        asyncio.shield(move), max(0.0, deadline - time.time())
+                    )
+                except asyncio.TimeoutError:
+                    client_log.warning("Frame deadline reached, using the best move so far")
+                    domain.cancel.set()
+                    key = await move
 
                 await websocket.send(
                     json.dumps({"cmd": "key", "key": key})
                 )  # send the key command to the server
-                
-            except websockets.exceptions.ConnectionClosedOK:
-                print("Server has cleanly disconnected us")
-                return
-            
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                print(
-                    f"EXCEPTION... superfoods eaten = {domain.superfood_eaten}, food eaten = {domain.food_eaten}"
-                )
-                return
+
+            await receiver  # raises how the connection ended
+
+        except websockets.exceptions.ConnectionClosedOK:
+            print("Server has cleanly disconnected us")
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            trace.dump(f"exception: {e!r}")
+            print(
+                f"EXCEPTION... superfoods eaten = {domain.superfood_eaten}, food eaten = {domain.food_eaten}"
+            )
+
+        finally:
+            receiver.cancel()
+            planner.shutdown(wait=False)
 
 
 SEED = os.environ.get("SEED", None)
+PROTOCOL = os.environ.get("PROTOCOL", "json")  # or "delta" for compact binary frames
+ROOM = os.environ.get("ROOM", "default")  # players of the same room play together
 
 # DO NOT CHANGE THE LINES BELLOW
 # You can change the default values using the command line, example:
@@ -0,0 +1,168 @@
+"""Parallel tournament runner.
+
+Spreads (seed, players, agent config) games over a process pool, one headless
+game (see simulator.py) per job, streams one row per player and game to a
+JSONL or CSV file and prints per-config statistics with confidence intervals.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import statistics
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from consts import TIMEOUT
+from simulator import play_game, set_log_level
+
+FIELDS = [
+    "config",
+    "seed",
+    "players",
+    "player",
+    "score",
+    "alive",
+    "steps",
+    "death_cause",
+    "foods_eaten",
+    "superfoods_eaten",
+    "agent_gave_up",
+    "moves",
+    "latency_p50_ms",
+    "latency_p90_ms",
+    "latency_p99_ms",
+    "latency_max_ms",
+]
+
+
+def run_job(job: dict) -> list[dict]:
+    """Play one game of the tournament, returning one row per player"""
+    result = play_game(
+        job["seed"], job["players"], timeout=job["timeout"], config=job["config"]
+    )
+
+    rows = []
+    for name, player in result["players"].items():
+        latency = player.pop("latency_ms")
+        rows.append(
+            {
+                "config": job["config_name"],
+                "seed": result["seed"],
+                "players": len(job["players"]),
+                "player": name,
+                **player,
+                **{f"latency_{key}_ms": value for key, value in latency.items()},
+            }
+        )
+    return rows
+
+
+def confidence_interval(values: list[float], z: float = 1.96) -> tuple[float, float]:
+    """Mean and half width of its confidence interval (normal approximation, 95% by default)"""
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, math.inf
+    return mean, z * statistics.stdev(values) / math.sqrt(len(values))
+
+
+class ResultWriter:
+    """Appends result rows to a JSONL or CSV file (by extension), flushing every game"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "w", newline="")
+        self._csv = None
+        if path.endswith(".csv"):
+            self._csv = csv.DictWriter(self._file, fieldnames=FIELDS)
+            self._csv.writeheader()
+
+    def write(self, rows: list[dict]):
+        for row in rows:
+            if self._csv is not None:
+                self._csv.writerow(row)
+            else:
+                self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def parse_config(value: str) -> tuple[str, dict]:
+    """NAME=JSON, e.g. nosafe={"safe_mode": false}"""
+    name, _, options = value.partition("=")
+    return name, json.loads(options or "{}")
+
+
+def print_summary(rows: list[dict]):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row["config"], row["players"])].append(row)
+
+    for (config, players), group in sorted(groups.items()):
+        score, score_ci = confidence_interval([row["score"] for row in group])
+        steps, steps_ci = confidence_interval([row["steps"] for row in group])
+        causes = Counter(row["death_cause"] or "survived" for row in group)
+        p99 = statistics.median(row["latency_p99_ms"] for row in group)
+        print(
+            f"{config} ({players} players, {len(group)} snakes): "
+            f"score {score:.2f} ± {score_ci:.2f}, steps {steps:.0f} ± {steps_ci:.0f}, "
+            f"median p99 move {p99:.1f}ms, {dict(causes)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seeds", help="Number of seeds per config", type=int, default=100)
+    parser.add_argument("--first-seed", help="First seed", type=int, default=1)
+    parser.add_argument(
+        "--players", help="Players per game, one or more", type=int, nargs="+", default=[1]
+    )
+    parser.add_argument(
+        "--config",
+        help='Agent config as NAME=JSON of SnakeDomain attributes, e.g. nosafe=\'{"safe_mode": false}\'',
+        action="append",
+        type=parse_config,
+    )
+    parser.add_argument("--timeout", help="Steps per game", type=int, default=TIMEOUT)
+    parser.add_argument("--workers", help="Worker processes", type=int, default=os.cpu_count())
+    parser.add_argument("--output", help="Results file (.jsonl or .csv)", default="tournament.jsonl")
+    args = parser.parse_args()
+
+    configs = args.config or [("default", {})]
+    jobs = [
+        {
+            "seed": seed,
+            "players": ["student"] + [f"student{i}" for i in range(1, players)],
+            "timeout": args.timeout,
+            "config_name": name,
+            "config": config,
+        }
+        for name, config in configs
+        for players in args.players
+        for seed in range(args.first_seed, args.first_seed + args.seeds)
+    ]
+
+    writer = ResultWriter(args.output)
+    rows = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=set_log_level, initargs=("CRITICAL",)
+    ) as pool:
+        futures = {pool.submit(run_job, job): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), start=1):
+            job = futures[future]
+            try:
+                game_rows = future.result()
+            except Exception as err:
+                print(f"Game {job['config_name']}/seed {job['seed']} failed: {err!r}")
+                continue
+            writer.write(game_rows)
+            rows.extend(game_rows)
+            print(f"[{done}/{len(jobs)}] {job['config_name']} seed {job['seed']}", end="\r")
+    writer.close()
+
+    print(f"\n{len(jobs)} games in {time.perf_counter() - started:.1f}s -> {args.output}")
+    if rows:
+        print_summary(rows)
@@ -1,4 +1,4 @@
-from collections import deque
+from collections import OrderedDict
 import pprint
 from utils import snake
 from utils.multi_objective_search import MultiObjectiveSearch
@@ -6,36 +6,135 @@ from utils.tree_search import *
 from utils.Directions import DIRECTION
 from utils.snake import Snake
 from utils.tree_search import SearchNode
+from utils.dstar_lite import DStarLite
+from utils import grid, trace
 import time
 import datetime
 import consts
+import os
 import random
+import threading
 import logging
+import numpy as np
+
+moves_log = trace.get_tracer("moves")
+search_log = trace.get_tracer("search")
+regions_log = trace.get_tracer("regions")
 
-logging.basicConfig(
-    filename="project.log",
-    filemode="a",
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    level=logging.DEBUG,
-)
 EATING_SUPERFOOD = True
 SAFE_MODE = True
+# where the all-pairs distance tables are cached between runs (None disables it)
+DISTANCE_CACHE_DIR = os.environ.get("DISTANCE_CACHE_DIR", ".cache")
+# ticks an interrupted search is resumed before giving up on its goal
+MAX_SEARCH_RESUMES = 3
+# plan routes with the incremental shortest path planners before searching
+INCREMENTAL_PLANNING = True
+# incremental planners kept between ticks, one per (goal cell, traverse)
+MAX_PLANNERS = 8
+
+
+class SnakeState:
+    """Search state of the snake, with cells packed as x * height + y"""
+
+    __slots__ = ("body", "occupied", "grow", "traverse", "objectives", "food_type")
+
+    def __init__(
+        self,
+        body: tuple[int, ...],
+        occupied: int,
+        grow: int,
+        traverse: bool,
+        objectives: tuple[int, ...],
+        food_type: str | None = None,
+    ):
+        self.body = body  # head first, copied (not shared) by each child, see result
+        self.occupied = occupied  # bitset of the cells in body
+        self.grow = grow
+        self.traverse = traverse
+        self.objectives = objectives
+        self.food_type = food_type  # only set on the root state
+
+    def __repr__(self):
+        return (
+            f"SnakeState(body={self.body}, grow={self.grow}, "
+            f"traverse={self.traverse}, objectives={self.objectives})"
+        )
+
 
 class SnakeDomain(SearchDomain):
     def __init__(self, map: dict, seed: int | None = None):
-        random.seed(None if seed is None else int(seed))
+        # own generator, so the agent does not reseed the global one (shared with an in-process game)
+        self.random = random.Random(None if seed is None else int(seed))
         self.dim: tuple[int, int] = tuple(map["size"])
         self.time_per_frame: float = 1 / int(map["fps"])
         self.board: list[list[int]] = map["map"]
         self.board_copy: list[list[int]] = map["map"]
+
+        # Search tables
+        self.cell_bits: list[int] = [1 << cell for cell in range(self.dim[0] * self.dim[1])]
+        self.neighbours: dict[bool, list[dict[DIRECTION, int]]] = {
+            traverse: self.build_neighbours(traverse) for traverse in (True, False)
+        }
+        self.cell_moves: dict[bool, list[list[int]]] = {
+            traverse: [list(moves.values()) for moves in table]
+            for traverse, table in self.neighbours.items()
+        }
+        self.food_cells: set[int] = set()
+        # D* Lite planners, least recently used first (see incremental_plan)
+        self.planners: OrderedDict[tuple[int, bool], DStarLite] = OrderedDict()
+        # all-pairs shortest path lengths between packed cells, per traverse mode
+        self.distances: dict[bool, np.ndarray] = {}
+        # heuristic rows of the current problem, per (traverse, objectives left)
+        self.goal_rows: dict = {}
+        self.sight_cells: list[int] = []  # tile per packed cell, from the last sight
+        self.enemy_positions: list[list[int]] = []
+        self.stone_bits = 0  # bitset of the stone cells
+        self.enemy_bits = 0  # bitset of the enemy cells in sight
+        # bitsets of the first/last row and column, to shift the occupancy a cell at a time (see flood)
+        height = self.dim[1]
+        self.all_bits = (1 << len(self.cell_bits)) - 1
+        self.first_y = sum(self.cell_bits[x * height] for x in range(self.dim[0]))
+        self.last_y = self.first_y << (height - 1)
+        self.first_x = (1 << height) - 1
+        self.last_x = self.first_x << (len(self.cell_bits) - height)
+        # safety of the states checked this tick, per (head, tail, occupancy, traverse)
+        self.safety: dict[tuple, bool] = {}
+        # free areas of this tick (see update_regions): region per packed cell (-1 blocked),
+        # their sizes and the regions the head can move into, preferring roomy ones
+        self.regions: list[int] = []
+        self.region_sizes: list[int] = []
+        self.head_regions: set[int] = set()
+        self.reachable: np.ndarray = np.ones(self.dim, dtype=bool)
+        self.region_body: tuple[int, ...] = ()  # body and traverse the regions were labelled for
+        self.region_traverse = False
+        # distance to the closest enemy in sight and the derived heuristic penalty, per traverse mode
+        self.enemy_distance: dict[bool, np.ndarray] = {}
+        self.enemy_danger: dict[bool, list[float]] = {
+            traverse: [3 / (1 + 100)] * len(self.cell_bits) for traverse in (True, False)
+        }
         
-        # (x, y): count
-        self.map_positions: dict = {}
-        self.map_positions_copy: set = set()
-        self.recent_explored_positions: deque[tuple[int, int]] = deque()
+        # exploration: times each cell was seen, cells not seen since the last refresh
+        self.visits: np.ndarray = np.zeros(self.dim, dtype=np.int32)
+        self.unexplored: np.ndarray = np.zeros(self.dim, dtype=bool)
+        self.passable: np.ndarray = np.zeros(self.dim, dtype=bool)
+        # passable cells in the 3x3 box around each cell (static), see find_goal
+        self.passable_around: np.ndarray = np.ones(self.dim)
+        # fixed random order among equally good goals, so exploration does not sweep the map in order
+        self.goal_order: np.ndarray = np.zeros(self.dim)
+        # explorations so far and the one that last explored each cell (-1 never); cells
+        # explored within the last recent_explored explorations stay explored on refresh
+        self.explored_at: np.ndarray = np.full(self.dim, -1, dtype=np.int64)
+        self.explorations = 0
+        self.recent_explored = 0
 
         self.plan = []
         self.state_plan: list[SearchNode] = []
+        # set (from another thread) to stop the running search at the frame deadline
+        self.cancel = threading.Event()
+        # search interrupted at the deadline, resumed on the next tick (see resume_problem)
+        self.pending_tree: SearchTree | None = None
+        self.search_resumes = 0
+        self.last_move: DIRECTION | None = None
 
         # Foods
         self.following_plan_to_food = False
@@ -47,6 +146,12 @@ class SnakeDomain(SearchDomain):
         self.multi_objectives = MultiObjectiveSearch([])
         self.counter = 0
 
+        # Modes (per game, starting from the module defaults)
+        self.eating_superfood = EATING_SUPERFOOD
+        self.safe_mode = SAFE_MODE
+        self.max_search_resumes = MAX_SEARCH_RESUMES
+        self.incremental_planning = INCREMENTAL_PLANNING
+
         # Debugging
         self.maxDist = 0
         self.superfood_eaten = 0
@@ -54,207 +159,242 @@ class SnakeDomain(SearchDomain):
         
         
     async def startupMap(self):
-        for x in range(self.dim[0]):
-            for y in range(self.dim[1]):
-                if self.board[x][y] != consts.Tiles.STONE:
-                    self.map_positions[(x, y)] = 0
-                    self.map_positions_copy.add((x, y))
-                if self.board[x][y] == consts.Tiles.FOOD:
-                    self.foods_in_map.add((x, y))
-        self.recent_explored_positions = deque(
-            maxlen=len(self.map_positions) // 2
-        )  # 50% of the map
-
-    def actions(self, state) -> list[DIRECTION]:
-        snake_body = state["snake_body"]
-        snake_traverse = state["snake_traverse"]
+        board = np.asarray(self.board)
+        stones = board == consts.Tiles.STONE
+        self.passable = ~stones
+        for cell in np.flatnonzero(stones).tolist():
+            self.stone_bits |= self.cell_bits[cell]
+        self.unexplored = self.passable.copy()
+        self.foods_in_map.update(map(tuple, np.argwhere(board == consts.Tiles.FOOD).tolist()))
+        self.recent_explored = int(self.passable.sum()) // 2  # 50% of the map
+
+        # the map is static, so the passable cells around each cell and the shortest paths between cells are computed once
+        self.passable_around = np.maximum(grid.box_sum(self.passable, 1), 1)
+        self.goal_order = np.random.default_rng(self.random.getrandbits(32)).random(self.dim)
+        self.distances = {
+            True: grid.all_pairs_distances(
+                np.ones(self.dim, dtype=bool), wrap=True, cache_dir=DISTANCE_CACHE_DIR
+            ),
+            False: grid.all_pairs_distances(
+                ~stones, wrap=False, cache_dir=DISTANCE_CACHE_DIR
+            ),
+        }
 
+    def actions(self, state: "SnakeState") -> list[DIRECTION]:
         actlist: list[DIRECTION] = []
-        snake_head = snake_body[0]
-        for dir in DIRECTION:
-            new_position = [snake_head[0] + dir.dir[0], snake_head[1] + dir.dir[1]]
-
-            # if traverse is true we can go through the map and walls
-            if snake_traverse:
-                new_position[0] = new_position[0] % self.dim[0]
-                new_position[1] = new_position[1] % self.dim[1]
-            else:
-                # if the new position is out of the map, we ignore it
-                if not (
-                    0 <= new_position[0] < self.dim[0]
-                    and 0 <= new_position[1] < self.dim[1]
-                ):
-                    continue
-
-            if (
-                new_position in snake_body
-                or (not EATING_SUPERFOOD and tuple(new_position) in self.super_foods_in_map)
-                ):
+        for dir, cell in self.neighbours[state.traverse][state.body[0]].items():
+            # the table already skips map edges (and stones) when not traversing
+            if state.occupied & self.cell_bits[cell]:
                 continue
 
-            sight = state["snake_sight"]
-            if sight.get(str(new_position[0]), {}).get(str(new_position[1]), 0) == consts.Tiles.SNAKE:
+            if not self.eating_superfood and divmod(cell, self.dim[1]) in self.super_foods_in_map:
                 continue
 
-            # # If new_position is adjacent to snake, better be safe
-            for dir_1 in DIRECTION:
-                pos = dir_1 + new_position
-                if sight.get(str(pos[0] % self.dim[0]), {}).get(str(pos[1] % self.dim[1]), 0) == consts.Tiles.SNAKE:
-                    continue
+            if self.sight_cells[cell] == consts.Tiles.SNAKE:
+                continue
 
+            # from where the snake is now, avoid the regions too small for it (dead ends)
             if (
-                snake_traverse
-                or self.board[new_position[0]][new_position[1]] != consts.Tiles.STONE
+                state.body == self.region_body  # stops at the head for other states
+                and state.traverse == self.region_traverse
+                and self.regions[cell] not in self.head_regions
             ):
-                actlist.append(dir)
-
-        return actlist
-
-    def result(self, state, action):
-        # logging.info("Result method")
-        snake_body = state["snake_body"]
-
-        head = snake_body[0]
-
-        # new head position
-        new_head = [head[0] + action.dir[0], head[1] + action.dir[1]]
+                continue
 
-        if state["snake_traverse"]:
-            new_head[0] = new_head[0] % self.dim[0]
-            new_head[1] = new_head[1] % self.dim[1]
+            actlist.append(dir)
 
-        # for now the snake_body only contains the head
-        new_snake_body = [new_head]
+        return actlist
 
-        # for each body part, we push it to the next position (example, the
-        # part that is closer to the head will have the same position as the old head and so on)
-        for i in range(len(snake_body) - 1):
-            new_snake_body.append(snake_body[i])
+    def result(self, state: "SnakeState", action: DIRECTION) -> "SnakeState":
+        body = state.body
+        new_head = self.neighbours[state.traverse][body[0]][action]
 
-        grow = state["grow"]
+        # the body shifts one cell towards the head; the tail only stays if growing.
+        # The tuple is copied, not shared with the parent (e.g. as a linked list): the copy
+        # is one C-level memcpy, cheaper than hashing the body for state_key, which any
+        # exact key needs as the cells' order matters, not only the occupied bitset
+        grow = state.grow
         if 0 < grow:
-            new_snake_body.append(snake_body[-1])
+            new_body = (new_head,) + body
+            occupied = state.occupied | self.cell_bits[new_head]
             grow -= 1
+        else:
+            new_body = (new_head,) + body[:-1]
+            occupied = (state.occupied & ~self.cell_bits[body[-1]]) | self.cell_bits[new_head]
 
         # if the new head is in a food position, we add a new body part to the snake
-        if (new_head[0], new_head[1]) in self.foods_in_map | self.super_foods_in_map:
-            grow += 2 if state.get("food_type", "") == "super" else 1
-
-
-        newstate = {
-            "snake_body": new_snake_body,
-            "snake_traverse": False if state.get("food_type", "") == "super" else state["snake_traverse"],
-            "snake_sight": state["snake_sight"],
-            "objectives": (
-                []
-                if not state["objectives"]
-                else (
-                    state["objectives"]
-                    if new_head != state["objectives"][0]
-                    else state["objectives"][1:]
-                )
-            ),
-            "grow": grow,
-        }
-        # logging.info(f"\tNew state in result function: {newstate}")
-        return newstate
+        if new_head in self.food_cells:
+            grow += 2 if state.food_type == "super" else 1
+
+        objectives = state.objectives
+        if objectives and new_head == objectives[0]:
+            objectives = objectives[1:]
+
+        return SnakeState(
+            new_body,
+            occupied,
+            grow,
+            False if state.food_type == "super" else state.traverse,
+            objectives,
+        )
 
     def cost(self, state, action):
         return 1
 
-    def heuristic(self, new_state, goal):
-        # logging.info("Heuristic method")
-        snake_head = new_state["snake_body"][0]
-        snake_traverse = new_state["snake_traverse"]
-        objectives = new_state["objectives"]
-        heuristic = 0
-
-        min_dist = 100
-        for row, cols in new_state["snake_sight"].items():
-            for col, value in cols.items():
-                if value == consts.Tiles.SNAKE:
-                    dist = self.calculateDistance(snake_head, (int(row), int(col)), snake_traverse)
-                    if dist < min_dist:
-                        min_dist = dist
-        heuristic += 3 / (1 + min_dist) 
-
-        if objectives:
-            heuristic += self.calculateDistance(
-                snake_head, objectives[0], snake_traverse
-            )
-            for i in range(len(objectives) - 1):
-                heuristic += self.calculateDistance(
-                    objectives[i], objectives[i + 1], snake_traverse
-                )
-            heuristic += self.calculateDistance(objectives[-1], goal, snake_traverse)
-            return heuristic
-        else:
-            heuristic += self.calculateDistance(snake_head, goal, snake_traverse)
-            return heuristic
+    def heuristic(self, new_state: "SnakeState", goal: int):
+        snake_head = new_state.body[0]
+        key = (new_state.traverse, new_state.objectives)
+        if key not in self.goal_rows:
+            self.goal_rows[key] = self.goal_row(new_state.traverse, new_state.objectives, goal)
+        distances, remaining = self.goal_rows[key]
 
-    def calculateDistance(self, start, end, snake_traverse):
-        dx = abs((end[0] - start[0]))
-        dy = abs((end[1] - start[1]))
-        if snake_traverse:
-            dx = min(dx, self.dim[0] - dx)
-            dy = min(dy, self.dim[1] - dy)
+        return self.enemy_danger[new_state.traverse][snake_head] + distances[snake_head] + remaining
+
+    def goal_row(self, snake_traverse: bool, objectives: tuple[int, ...], goal: int):
+        """Distances from every cell to the next objective, plus the length of the rest of the route"""
+        route = objectives + (goal,)
+        table = self.distances[snake_traverse]
+        remaining = sum(int(table[a, b]) for a, b in zip(route, route[1:]))
+        return table[route[0]].tolist(), remaining
 
-        return dx + dy
+    def calculateDistance(self, start, end, snake_traverse):
+        """Shortest path length on the static map (stones only block when not traversing)"""
+        return int(self.distances[snake_traverse][self.pack(start), self.pack(end)])
+
+    def is_safe(self, state: "SnakeState") -> bool:
+        """Partial plans must not end where the snake has no move left or gets trapped"""
+        return len(self.actions(state)) > 0 and self.safe(state)
+
+    def safe(self, state: "SnakeState") -> bool:
+        """Whether the snake can still follow its tail, or has at least its length of free cells around"""
+        body = state.body
+        key = (body[0], body[-1], state.occupied, state.traverse)
+        if key not in self.safety:
+            tail = self.cell_bits[body[-1]]
+            free = (self.all_bits & ~state.occupied & ~self.enemy_bits) | tail
+            if not state.traverse:
+                free &= ~self.stone_bits
+            region = self.flood(body[0], free, state.traverse)
+            self.safety[key] = bool(region & tail) or region.bit_count() - 1 >= len(body)
+        return self.safety[key]
+
+    def flood(self, start: int, free: int, traverse: bool) -> int:
+        """Bitset of the free cells connected to start, growing all of its border at once"""
+        height = self.dim[1]
+        wrap_x = len(self.cell_bits) - height
+        first_y, last_y, first_x, last_x = self.first_y, self.last_y, self.first_x, self.last_x
+        region = self.cell_bits[start]
+        free |= region
+        while True:
+            grown = (
+                region
+                | (region & ~last_y) << 1
+                | (region & ~first_y) >> 1
+                | (region & ~last_x) << height
+                | region >> height
+            )
+            if traverse:
+                grown |= (
+                    (region & last_y) >> (height - 1)
+                    | (region & first_y) << (height - 1)
+                    | (region & last_x) >> wrap_x
+                    | (region & first_x) << wrap_x
+                )
+            grown &= free
+            if grown == region:
+                return region
+            region = grown
+
+    def state_key(self, state: "SnakeState"):
+        return (state.body, state.grow, len(state.objectives), state.traverse)
+
+    def satisfies(self, state: "SnakeState", goal: int):
+        return not state.objectives and goal == state.body[0] and self.safe(state)
+
+    def pack(self, pos) -> int:
+        """Packs a (x, y) position into a single cell index (x * height + y)"""
+        return pos[0] * self.dim[1] + pos[1]
+
+    def search_state(self, state: dict) -> "SnakeState":
+        """Builds the compact search state from the state dict of the current tick"""
+        body = tuple(self.pack(pos) for pos in state["snake_body"])
+        occupied = 0
+        for cell in body:
+            occupied |= self.cell_bits[cell]
+        return SnakeState(
+            body,
+            occupied,
+            state["grow"],
+            state["snake_traverse"],
+            tuple(self.pack(pos) for pos in state["objectives"]),
+            state.get("food_type"),
+        )
 
-    def satisfies(self, state, goal):
-        snake_head = state["snake_body"][0]
-        # logging.info(f"Satisfies method")
-        # logging.info(f"\tsnake_head == goal: snake_head: {snake_head}, goal: {goal}")
-        # logging.info(f"\tObjectives: {state['objectives']}")
-        return state["objectives"] == [] and goal == snake_head
+    def build_neighbours(self, traverse: bool) -> list[dict[DIRECTION, int]]:
+        """For each cell, the cells reachable with one move (wrapping around if traverse)"""
+        width, height = self.dim
+        table = []
+        for x in range(width):
+            for y in range(height):
+                moves = {}
+                for dir in DIRECTION:
+                    nx, ny = x + dir.dir[0], y + dir.dir[1]
+                    if traverse:
+                        nx, ny = nx % width, ny % height
+                    elif not (0 <= nx < width and 0 <= ny < height) or self.board[nx][ny] == consts.Tiles.STONE:
+                        continue
+                    moves[dir] = nx * height + ny
+                table.append(moves)
+        return table
 
     def get_next_move(self, snake: Snake) -> str:
         """Returns the next move to be taken by the snake"""
 
-        logging.info("GetNextMove: Started computing...")
+        moves_log.debug("GetNextMove: Started computing...")
         ti: float = time.time()
-        global EATING_SUPERFOOD
-        global SAFE_MODE
 
         state = {
             "snake_body": snake.snake,
             "snake_traverse": snake.snake_traverse,
-            "snake_sight": snake.snake_sight,
             "objectives": self.multi_objectives.get_list_of_objectives(),
             "timestamp": datetime.datetime.fromisoformat(snake.timestamp).timestamp(),
             "grow": 0,
-            "ignore": [],
         }
 
-        # Remove self from sight
-        for row, cols in snake.snake_sight.items():
-            for col, value in cols.items():
-                if [int(row), int(col)] in snake.snake:
-                    state["snake_sight"][row][col] = consts.Tiles.PASSAGE
+        # Sight without ourselves (already removed when decoding it)
+        self.sight_mask = snake.sight_mask
+        self.sight_cells = snake.sight_tiles.ravel().tolist()
+        self.enemy_positions = snake.cells_of(consts.Tiles.SNAKE).tolist()
+        self.enemy_bits = 0
+        for pos in self.enemy_positions:
+            self.enemy_bits |= self.cell_bits[self.pack(pos)]
+        self.safety = {}
+        self.update_enemy_distance(snake)
+        self.update_regions(tuple(self.pack(pos) for pos in snake.snake), snake.snake_traverse)
         
         snake_range = snake.snake_range
         step = snake.step
         
         if state["snake_traverse"] and snake_range >= 5:
             # print("RANGE AND TRAVERSE -> MODE: NOT EATING SUPERFOOD")
-            EATING_SUPERFOOD = False
+            self.eating_superfood = False
         
         if step >= 2600:
             # print("STEP 2600 -> MODE: EATING SUPERFOOD")
-            EATING_SUPERFOOD = True
+            self.eating_superfood = True
 
         
-        if SAFE_MODE:
-            EATING_SUPERFOOD = False
+        if self.safe_mode:
+            self.eating_superfood = False
 
             if 30 <= snake.score or 1300 <= step:
-                EATING_SUPERFOOD = True
-                SAFE_MODE = False
-                print(f"No more safe mode! (step={step}; score={snake.score})")
+                self.eating_superfood = True
+                self.safe_mode = False
+                moves_log.info("No more safe mode! (step=%s; score=%s)", step, snake.score)
         
 
         # 1. Update the map removing the snake sight
-        self.updateMapCopy(state["snake_sight"])
+        self.updateMapCopy(self.sight_mask)
 
 
 
@@ -270,23 +410,24 @@ class SnakeDomain(SearchDomain):
                 self.super_foods_in_map.add(super_food)
 
         head = state["snake_body"][0]
+        # eaten on the way (not as the goal), there is no plan to a food under the head
+        self.foods_in_map.discard(tuple(head))
+        self.super_foods_in_map.discard(tuple(head))
         
-        logging.info(f"foods_in_map: {self.foods_in_map}")
-        logging.info(f"super_foods_in_map: {self.super_foods_in_map}\n")
-
-        logging.info(f"\tSnake head: {head}")
-        if not self.multi_objectives.is_empty():
-            logging.info(f"\tNext goal: {self.multi_objectives.get_next_goal()}")
-        logging.info(f"\tObjectives: {self.multi_objectives.get_list_of_objectives()}")
-        logging.info(f"\tPlan: {self.plan}")
-        logging.info(f"\tFollowing plan to food: {self.following_plan_to_food}")
-        logging.info(f"\tFoods in map: {self.foods_in_map}")
-        # logging.info(f"\tBoard copy: {self.board_copy}")
+        if moves_log.isEnabledFor(logging.DEBUG):
+            moves_log.debug("foods_in_map: %s", self.foods_in_map)
+            moves_log.debug("super_foods_in_map: %s", self.super_foods_in_map)
+            moves_log.debug("\tSnake head: %s", head)
+            if not self.multi_objectives.is_empty():
+                moves_log.debug("\tNext goal: %s", self.multi_objectives.get_next_goal())
+            moves_log.debug("\tObjectives: %s", self.multi_objectives.get_list_of_objectives())
+            moves_log.debug("\tPlan: %s", self.plan)
+            moves_log.debug("\tFollowing plan to food: %s", self.following_plan_to_food)
 
         # If there are foods in the map
         exists_food_in_map = (
             (normal_food := len(self.foods_in_map) > 0)
-            or (EATING_SUPERFOOD and len(self.super_foods_in_map) > 0)
+            or (self.eating_superfood and len(self.super_foods_in_map) > 0)
         )
 
         closest_food = self.get_closest_food(state=state, normal_food=normal_food) if exists_food_in_map else None
@@ -297,20 +438,20 @@ class SnakeDomain(SearchDomain):
         ):
             # clear the list of objectives
             self.multi_objectives.clear_goals()
-            logging.info("\tCreating list objectives to food")
+            moves_log.info("\tCreating list objectives to food")
 
             for point in self.create_list_objectives(state, closest_food):
                 self.multi_objectives.add_goal(point)
                 
             state["food_type"] = "normal" if normal_food else "super"
 
-            logging.info(f"\t{'Super' if not normal_food else ''} Food Position: {closest_food}")
+            moves_log.info("\t%sFood Position: %s", "" if normal_food else "Super ", closest_food)
             self.following_plan_to_food = True
             self.create_problem(state)
             
         elif 0 < len(self.forgotten_foods) and self.plan and not self.following_plan_to_food:
             food, food_type = self.forgotten_foods.pop()
-            logging.info(f"Following plan to forgotten food {food} of type {food_type}")
+            moves_log.info("Following plan to forgotten food %s of type %s", food, food_type)
 
             self.multi_objectives.clear_goals()
             for point in self.create_list_objectives(state, food):
@@ -327,26 +468,20 @@ class SnakeDomain(SearchDomain):
         # fazer tipo pintar vetores
         # começa a PASSAGE, se passa por cauda pinta SNAKE, se voltar a passar pinta PASSAGE
         elif self.multi_objectives.is_empty():
-            logging.info("\tMulti objectives was empty")
+            moves_log.info("\tMulti objectives was empty")
             goal = self.find_goal(state)
             for point in self.create_list_objectives(state, goal):
                 self.multi_objectives.add_goal(point)
 
-            self.createIgnoreList(state)
 
-            logging.info(f"\tGoal : {goal}")
-            logging.info(f"\tAt goal there is: {self.board[goal[0]][goal[1]]}")
-            logging.info(f"\tCreating a new path to goal: {self.multi_objectives.get_list_of_objectives()}")
-            self.create_problem(state)
-
-        elif self.snake_in_sight(state["snake_sight"], state["snake_body"]):
-            logging.info("\tSnake in sight, clearing objectives")
+            moves_log.info("\tGoal : %s", goal)
+            moves_log.debug("\tAt goal there is: %s", self.board[goal[0]][goal[1]])
             self.create_problem(state)
 
         # if the snake has reached the goal
         elif head == self.multi_objectives.get_next_goal():
-            logging.info("\tReached objective!")
-            # If following plan to food, update the map_positions_copy
+            moves_log.info("\tReached objective!")
+            # If following plan to food, update the unexplored cells
             if self.following_plan_to_food:
                 if normal_food:
                     self.counter += 1
@@ -359,7 +494,7 @@ class SnakeDomain(SearchDomain):
                 self.foods_in_map.discard(tuple(head))
                 self.super_foods_in_map.discard(tuple(head))
 
-                self.updateMapCopy(state["snake_sight"])
+                self.updateMapCopy(self.sight_mask)
                 self.following_plan_to_food = False
 
             self.multi_objectives.clear_goals()
@@ -370,35 +505,43 @@ class SnakeDomain(SearchDomain):
             # Create a new problem
             self.create_problem(state)
 
+        # checked after reaching the goal, a search from the goal itself finds no move
+        elif self.snake_in_sight():
+            moves_log.info("\tSnake in sight, clearing objectives")
+            self.create_problem(state)
+
+        # Following a partial plan, keep searching for the goal from where we are
+        elif self.pending_tree is not None:
+            search_log.info("\tResuming the last search")
+            self.resume_problem(state)
+
         move = self.plan.pop(0)
         move_state = self.state_plan.pop(0)
-        logging.error(f"Expected state = {move_state}")
-        logging.error(f"Real state = {state}")
-        # if move_state["snake_body"][0] != head:
-        #     logging.error(f"head = {head}")
-        #     logging.error(f"Wrong head position")
-        #     logging.error(f"move: {move_state}")
-        #     logging.error(f"move state.staet {move_state.state}")
+        moves_log.debug("Expected state = %s", move_state)
+        moves_log.debug("Real state = %s", state)
 
         ## Panic move (In case a snake appears in front or traverse switch)
-        if move not in (valid_moves := self.actions(state)):
-            logging.error(f"PANIC MOVE! move = {move}, valid_moves = {valid_moves}, state = {state}")
-            logging.error(f"Excepted state = {move_state}")
-            logging.error(f"Real state = {state}")
-            logging.error(f"complete plan = {self.__backup_of_plan}")
-            logging.error(f"Self = {self.__dict__}")
-            move = random.choice(valid_moves)
+        if move not in (valid_moves := self.actions(self.search_state(state))):
+            moves_log.warning("PANIC MOVE! move = %s, valid_moves = %s, state = %s", move, valid_moves, state)
+            if moves_log.isEnabledFor(logging.DEBUG):
+                moves_log.debug("Expected state = %s", move_state)
+                moves_log.debug("complete plan = %s", self.__backup_of_plan)
+                moves_log.debug("Self = %s", self.__dict__)
+            trace.dump("panic move")
+            if valid_moves:  # else trapped, any move ends the game
+                move = self.random.choice(valid_moves)
             self.following_plan_to_food = False
             self.multi_objectives.clear_goals()
             self.plan = []
 
-        pp=move + head
-        logging.info("At new_pos there is: " + str(self.board[pp[0]%self.dim[0]][pp[1]%self.dim[1]]))
-
-        logging.info("Chosen final move" + str(move))
-        logging.info("Valid moves: " + str(valid_moves))
+        self.last_move = move
+        if moves_log.isEnabledFor(logging.DEBUG):
+            pp = move + head
+            moves_log.debug("At new_pos there is: %s", self.board[pp[0] % self.dim[0]][pp[1] % self.dim[1]])
+            moves_log.debug("Chosen final move %s", move)
+            moves_log.debug("Valid moves: %s", valid_moves)
         # ======================== DEBUG ========================
-        # print(f"\n\n{self.map_positions_copy}")
+        # print(f"\n\n{self.unexplored}")
         tf: float = time.time()
         dt: float = tf - ti
         diff_to_server = (
@@ -406,7 +549,7 @@ class SnakeDomain(SearchDomain):
         )
         if diff_to_server > self.maxDist:
             self.maxDist = diff_to_server
-        logging.info(
+        moves_log.debug(
             "\tgetNextMove time to compute %.2fms (diff to server %.2fms (max diff %.2fms))",
             dt * 1000,
             diff_to_server * 1000,
@@ -416,22 +559,83 @@ class SnakeDomain(SearchDomain):
 
         return move.key
 
+    def reset_plan(self):
+        """Forgets the goals and the plan (e.g. after skipped frames), a new goal is chosen next tick"""
+        self.multi_objectives.clear_goals()
+        self.following_plan_to_food = False
+        self.pending_tree = None
+        self.search_resumes = 0
+        self.plan = []
+        self.state_plan = []
+
     def create_problem(self, state, goal=None):
-        logging.info("Create Problem method")
+        search_log.debug("Create Problem method")
+        self.pending_tree = None
+        self.search_resumes = 0
 
         objectives = self.multi_objectives.get_list_of_objectives()
         state["objectives"] = objectives[:-1]
         goal = list(objectives[-1])
 
+        self.food_cells = {
+            self.pack(food) for food in self.foods_in_map | self.super_foods_in_map
+        }
+        self.goal_rows = {}
+        initial = self.search_state(state)
+        if self.incremental_planning and self.incremental_plan(initial, self.pack(goal)):
+            search_log.debug("\tIncremental plan: %s", self.plan)
+            return
+
+        problem = SearchProblem(self, initial, self.pack(goal))
+        tree = SearchTree(problem, "greedy", anytime=True)
+        self.run_search(tree, state, objectives, goal)
+
+    def resume_problem(self, state):
+        """Continues the search interrupted on the last tick, from the snake's current state"""
+        tree, self.pending_tree = self.pending_tree, None
+
+        objectives = self.multi_objectives.get_list_of_objectives()
+        if not objectives or self.pack(objectives[-1]) != tree.problem.goal:
+            return self.create_problem(state)
+        state["objectives"] = objectives[:-1]
+        goal = list(objectives[-1])
+
+        self.food_cells = {
+            self.pack(food) for food in self.foods_in_map | self.super_foods_in_map
+        }
+        self.goal_rows = {}
+        if (
+            self.last_move is None
+            or not tree.advance(self.last_move)
+            or self.state_key(tree.problem.initial) != self.state_key(self.search_state(state))
+        ):
+            search_log.info("\tCould not resume the last search")
+            return self.create_problem(state)
+        self.search_resumes += 1
+        self.run_search(tree, state, objectives, goal)
+
+    def run_search(self, tree: SearchTree, state, objectives, goal):
         TOLERANCE = 0.01 # 10 ms
         timeout = self.time_per_frame - time.time() + state["timestamp"] - TOLERANCE
 
-        problem = SearchProblem(self, state, goal)
-        tree = SearchTree(problem, "greedy")
-        result = tree.search(timeout=timeout)
+        result = tree.search(timeout=timeout, cancel=self.cancel)
 
-        if result is None:
-            logging.error(f"\tNo solution found, goal: {goal}, state: {state}")
+        if (
+            result is None
+            and tree.interrupted
+            and self.search_resumes < self.max_search_resumes
+            and (self.plan or tree.best.parent is not None)
+        ):
+            # out of time: the search is resumed next tick, meanwhile follow the last
+            # complete plan or, without one, the way to the most promising node
+            self.pending_tree = tree
+            if not self.plan:
+                self.plan = tree.best_plan()
+                self.state_plan = tree.get_path(tree.best)
+                self.__backup_of_plan = self.plan.copy()
+                search_log.info("\tPartial plan: %s", self.plan)
+        elif result is None:
+            search_log.info("\tNo solution found, goal: %s, state: %s", goal, state)
             if self.following_plan_to_food:
                 food = tuple(objectives[0])
                 self.forgotten_foods.add((food, state.get("food_type", "normal")))
@@ -441,33 +645,107 @@ class SnakeDomain(SearchDomain):
             self.multi_objectives.clear_goals()  # No move found, so assume its not possible and reset objectives
             # E se, ao falhar, fizessemos a pesquisa ao contrario? da food para o objectivo?
             self.following_plan_to_food = False
-            valid_moves = self.actions(state)
+            valid_moves = self.actions(tree.problem.initial)
 
             if self.plan: # If  still has a backup plan
                 # print("Following backup plan")
-                logging.info(f"\tChose backup plan {self.plan}")
+                search_log.info("\tChose backup plan %s", self.plan)
                 return
             elif valid_moves:
-                move = random.choice(valid_moves)
-                logging.info(f"\tChose valid move: {move} from {valid_moves}")
+                move = self.random.choice(valid_moves)
+                search_log.info("\tChose valid move: %s from %s", move, valid_moves)
                 # print(f"Panic move! {move}")
                 self.plan = [move]
                 self.state_plan = [{}]
             else:
-                raise Exception(f"No valid moves, superfoods eaten = {self.superfood_eaten}, food eaten = {self.food_eaten}")
+                # trapped (e.g. by an enemy), keep going instead of giving up: any move ends the game
+                search_log.warning(
+                    "\tNo valid moves, superfoods eaten = %s, food eaten = %s",
+                    self.superfood_eaten,
+                    self.food_eaten,
+                )
+                self.plan = [self.last_move or DIRECTION.UP]
+                self.state_plan = [{}]
+        elif tree.solution.parent is None:
+            # already at the goal (safely), there is no move to it: go for the next one
+            search_log.info("\tGoal %s reached at the root", goal)
+            self.multi_objectives.clear_goals()
+            self.following_plan_to_food = False
+            for point in self.create_list_objectives(state, self.find_goal(state)):
+                self.multi_objectives.add_goal(point)
+            self.create_problem(state)
         else:
             # print("Following calculated plan")
             self.plan = tree.plan()
             self.state_plan = tree.path()
             self.__backup_of_plan = self.plan.copy()
-        logging.info(f"\tPlan: {self.plan}")
-
+        search_log.debug("\tPlan: %s", self.plan)
+
+
+    def incremental_plan(self, initial: "SnakeState", goal: int) -> bool:
+        """Plans the route with the cached D* Lite planners, one leg per objective.
+
+        The body (but the tail), enemies in sight and avoided superfoods are blocked.
+        The plan is checked by simulating it; returns False, leaving the current plan,
+        when a leg has no path or the simulated snake would hit itself.
+        """
+        if initial.food_type == "super":
+            return False  # traverse changes on the way
+
+        traverse = initial.traverse
+        blocked = set(initial.body[1:-1])
+        blocked.update(self.pack(pos) for pos in self.enemy_positions)
+        if not self.eating_superfood:
+            blocked.update(self.pack(food) for food in self.super_foods_in_map)
+
+        actions = []
+        cell = initial.body[0]
+        for target in initial.objectives + (goal,):
+            path = self.planner(target, traverse).plan(cell, blocked)
+            if path is None:
+                return False
+            for next_cell in path:
+                moves = self.neighbours[traverse][cell]
+                actions.append(next(dir for dir, move in moves.items() if move == next_cell))
+                cell = next_cell
+        if not actions:
+            return False
+
+        states = [initial]
+        for action in actions:
+            if action not in self.actions(states[-1]):
+                return False
+            states.append(self.result(states[-1], action))
+        if not self.satisfies(states[-1], goal) or not self.is_safe(states[-1]):
+            return False
+
+        self.plan = actions
+        self.state_plan = states
+        self.__backup_of_plan = actions.copy()
+        return True
+
+    def planner(self, goal: int, traverse: bool) -> DStarLite:
+        """The incremental planner towards goal, created on first use"""
+        key = (goal, traverse)
+        planner = self.planners.pop(key, None)
+        if planner is None:
+            table = self.distances[traverse]
+            planner = DStarLite(
+                self.cell_moves[traverse], goal, lambda start: table[start].tolist()
+            )
+        self.planners[key] = planner
+        if len(self.planners) > MAX_PLANNERS:
+            self.planners.popitem(last=False)
+        return planner
 
     def get_closest_food(self, normal_food, state) -> list[int]:
+        """Closest food, among the ones the head can reach now if there are any"""
         head = state["snake_body"][0]
+        foods = self.foods_in_map if normal_food else self.super_foods_in_map
+        foods = [food for food in foods if self.reachable[food]] or foods
         return list(
             min(
-                self.foods_in_map if normal_food else self.super_foods_in_map,
+                foods,
                 key=lambda pos: self.calculateDistance(
                     head, pos, snake_traverse=state["snake_traverse"]
                 ),
@@ -475,127 +753,124 @@ class SnakeDomain(SearchDomain):
         )
 
     def create_list_objectives(self, state, goal):
-        """Get list of objectives to goal (currently going to the tail of the snake)"""
-        x_1, y_1 = state["snake_body"][-1]
-
-        return [
-            list(goal),
-            [x_1, y_1],
-        ]
+        """Get list of objectives to goal (satisfies checks the snake is safe once there)"""
+        return [list(goal)]
         
         
     def find_goal(self, state):
-        sight = state["snake_sight"]
-
-        if len(self.map_positions_copy) == 0:
-            self.updateMapCopy(sight, refresh=True)
-
-        selected_position = max(
-            self.map_positions_copy,
-            key=lambda pos: self.calculate_region_density(pos, 1) / (self.map_positions[pos] + 1)**2,
-        )
-
-        # print(f"Selected {selected_position} to visitr")
-
-        self.map_positions_copy.discard(selected_position)
-        
-        while (selected_position in self.super_foods_in_map) and not EATING_SUPERFOOD:
-            selected_position = max(
-                self.map_positions_copy,
-                key=lambda pos: self.calculate_region_density(pos, 1) / (self.map_positions[pos] + 1)**2,
-            )
-            self.map_positions_copy.discard(selected_position)
-            
-        
-        return selected_position
+        """Unexplored cell with the best density of unexplored cells around it per visit, all cells scored at once"""
+        candidates = self.goal_candidates()
+        if not candidates.any():
+            self.updateMapCopy(self.sight_mask, refresh=True)
+            candidates = self.goal_candidates()
+            if not candidates.any():
+                candidates = self.passable
+
+        density = grid.box_sum(self.unexplored, 1) / self.passable_around
+        score = np.where(candidates, density / (self.visits + 1) ** 2, -np.inf)
+        best = score == score.max()
+        x, y = np.unravel_index(np.argmax(np.where(best, self.goal_order, -1)), self.dim)
+        self.unexplored[x, y] = False
+        return (int(x), int(y))
+
+    def goal_candidates(self) -> np.ndarray:
+        """Unexplored cells the head can reach now, without the superfoods while not eating them"""
+        candidates = self.unexplored & self.reachable
+        if not candidates.any():
+            candidates = self.unexplored.copy()
+        if not self.eating_superfood and self.super_foods_in_map:
+            candidates[tuple(np.array(list(self.super_foods_in_map)).T)] = False
+        return candidates
     
-    def calculate_region_density(self, position, radius):
-        """Function to calculate the density of inexplored positions in a region of the map"""
-        x, y = position
-        density = 0
-        valid_neighbors = (2 * radius + 1) ** 2
-        for dx in range(-radius, radius + 1):
-            for dy in range(-radius, radius + 1):
-                neighbor = ((x + dx) % self.dim[0], (y + dy) % self.dim[1])
-                if self.board[neighbor[0]][neighbor[1]] == consts.Tiles.STONE:
-                    valid_neighbors -= 1 
-                if neighbor in self.map_positions:
-                    density += 1
-        return density / valid_neighbors
-    
-    def updateMapCopy(self, sight, refresh = False):
+    def updateMapCopy(self, sight_mask, refresh = False):
         if refresh or self.counter >= 2:
             # print("\nRefreshed Map")
-            self.map_positions_copy = set(self.map_positions.keys())
-            for pos in self.recent_explored_positions:
-                self.map_positions_copy.discard(pos)
-                self.counter = 0
-        
-        for row, cols in sight.items():
-            for col, value in cols.items():
-                pos = (int(row), int(col))
-
-                if pos in self.map_positions_copy:
-                    self.map_positions[pos] += 1
-                    self.map_positions_copy.discard(pos)
-                    if pos not in self.recent_explored_positions:
-                        self.recent_explored_positions.append(pos)
+            self.unexplored = self.passable & ~self.recently_explored()
+            self.counter = 0
+
+        seen = sight_mask & self.unexplored
+        self.visits[seen] += 1
+        self.unexplored &= ~seen
+        new = seen & ~self.recently_explored()
+        explored = int(new.sum())
+        self.explored_at[new] = np.arange(self.explorations, self.explorations + explored)
+        self.explorations += explored
+
+    def recently_explored(self) -> np.ndarray:
+        """Cells explored at most recent_explored explorations ago"""
+        return self.explored_at >= max(self.explorations - self.recent_explored, 0)
     
 
-    def snake_in_sight(self, sight, snake_body):
-        for row, cols in sight.items():
-            for col, value in cols.items():
-                if value == consts.Tiles.SNAKE and [int(row), int(col)] not in snake_body:
-                    return True
-        return False
-
-    def createIgnoreList(self, state: dict):
-        """ This solution has problem in a W snake configuration, but ignore for now 🙏 """
-        def calculateIgnores(width: int, height: int, reverse: bool = False):
-            ignoreList: set = set()
-            for x in range(width if not reverse else height):
-                ignore: set = set()
-                insideSnake: bool = False
-                lastWasSnake: bool = False
-                snakePasses: int = 0
-                for y in range(height if not reverse else width):
-                    pos = (x, y) if not reverse else (y, x)
-                    if list(pos) in state["snake_body"]:
-                        if lastWasSnake:
-                            continue
-                        lastWasSnake = True
-                        insideSnake = not insideSnake
-                        snakePasses += 1
-                    else:
-                        lastWasSnake = False
-
-                    if insideSnake:
-                        ignore.add((x, y))
-
-                if snakePasses > 1:
-                    ignoreList.update(ignore)
-            return ignoreList
-
-        state["ignore"] = calculateIgnores(*self.dim) | calculateIgnores(
-            *self.dim, reverse=True
+    def update_enemy_distance(self, snake: Snake):
+        """Distance field to the closest enemy segment in sight, computed once per tick"""
+        enemies = snake.sight_mask & (snake.sight_tiles == consts.Tiles.SNAKE)
+        for traverse in (True, False):
+            distance = grid.distance_field(enemies, wrap=traverse)
+            self.enemy_distance[traverse] = distance
+            # same penalty as before: 3 / (1 + distance), with distances capped at 100
+            self.enemy_danger[traverse] = (3 / (1 + np.minimum(distance, 100))).ravel().tolist()
+
+    def snake_in_sight(self):
+        return len(self.enemy_positions) > 0
+
+    def update_regions(self, body: tuple[int, ...], traverse: bool):
+        """Labels the connected free areas of this tick (BFS over the occupancy bitset)
+
+        The body but its tail (it moves away), the enemies in sight and, when not
+        traversing, the stones are blocked.
+        """
+        cell_bits = self.cell_bits
+        blocked = self.enemy_bits | (self.stone_bits if not traverse else 0)
+        for cell in body[:-1]:
+            blocked |= cell_bits[cell]
+
+        moves = self.cell_moves[traverse]
+        regions = [-1] * len(cell_bits)
+        sizes = []
+        for start in range(len(cell_bits)):
+            if regions[start] != -1 or blocked & cell_bits[start]:
+                continue
+            region = len(sizes)
+            regions[start] = region
+            frontier = [start]
+            for cell in frontier:
+                for next_cell in moves[cell]:
+                    if regions[next_cell] == -1 and not blocked & cell_bits[next_cell]:
+                        regions[next_cell] = region
+                        frontier.append(next_cell)
+            sizes.append(len(frontier))
+
+        self.regions, self.region_sizes = regions, sizes
+        self.region_body, self.region_traverse = body, traverse
+        head_regions = {regions[cell] for cell in moves[body[0]] if regions[cell] != -1}
+        # a region smaller than the snake (and without its tail to follow) is a dead
+        # end when there is another way out
+        self.head_regions = {
+            region
+            for region in head_regions
+            if sizes[region] >= len(body) or region == regions[body[-1]]
+        } or head_regions
+        self.reachable = np.isin(
+            np.asarray(regions).reshape(self.dim), list(self.head_regions)
         )
 
-        logging.info("STATE IGNORE: " +  str(state["ignore"]))
-        copy = [row.copy() for row in self.board]
+        if regions_log.isEnabledFor(logging.DEBUG):
+            self.log_regions(body)
 
+    def log_regions(self, body: tuple[int, ...]):
+        """Logs the board with the region of each free cell"""
+        symbols = "abcdefghijklmnopqrstuvwxyz"
+        regions_log.debug("REGIONS: sizes %s, head regions %s", self.region_sizes, self.head_regions)
         for x in range(self.dim[0]):
+            line = []
             for y in range(self.dim[1]):
-                if copy[x][y] in [consts.Tiles.PASSAGE, consts.Tiles.FOOD]:
-                    copy[x][y] = "."
-                if (x, y) in state["ignore"]:
-                    copy[x][y] = "I"
-                    continue
-                if [x, y] in state["snake_body"]:
-                    copy[x][y] = "O"
-                    continue
-                if copy[x][y] == consts.Tiles.STONE:
-                    copy[x][y] = "#"
-        
-        logging.info("IGNORE LIST")
-        for line in copy:
-            logging.info(line)
+                cell = self.pack((x, y))
+                if cell in body:
+                    line.append("O")
+                elif self.board[x][y] == consts.Tiles.STONE and self.regions[cell] == -1:
+                    line.append("#")
+                elif self.regions[cell] == -1:
+                    line.append("S")
+                else:
+                    line.append(symbols[self.regions[cell] % len(symbols)])
+            regions_log.debug("".join(line))
@@ -0,0 +1,125 @@
+import heapq
+import math
+from typing import Callable, Sequence
+
+
+class DStarLite:
+    """D* Lite shortest paths from a moving start to a fixed goal cell.
+
+    The graph is a neighbour table of packed cells with unit moves; blocked cells
+    can not be entered nor left. The search runs backwards from the goal and keeps
+    its g/rhs values between plans, so when the start moves or a few cells are
+    (un)blocked only the affected vertices are repaired.
+
+    heuristic(start) gives lower bounds on the distance from start to every cell
+    (e.g. a row of the all-pairs table of the map without obstacles).
+    """
+
+    def __init__(
+        self,
+        neighbours: Sequence[Sequence[int]],
+        goal: int,
+        heuristic: Callable[[int], Sequence[int]],
+    ):
+        self.neighbours = neighbours
+        self.goal = goal
+        self.heuristic = heuristic
+        self.start = None
+        self.blocked: set[int] = set()
+        self.expansions = 0
+
+        cells = len(neighbours)
+        self._g = [math.inf] * cells
+        self._rhs = [math.inf] * cells
+        self._rhs[goal] = 0
+        self._km = 0
+        self._open: list = []  # heap of (key, cell), stale entries skipped via _keys
+        self._keys: dict[int, tuple] = {}
+        self._row = None
+
+    def _key(self, cell: int) -> tuple:
+        best = min(self._g[cell], self._rhs[cell])
+        return (best + self._row[cell] + self._km, best)
+
+    def _push(self, cell: int):
+        key = self._key(cell)
+        self._keys[cell] = key
+        heapq.heappush(self._open, (key, cell))
+
+    def _top(self):
+        while self._open:
+            key, cell = self._open[0]
+            if self._keys.get(cell) == key:
+                return key, cell
+            heapq.heappop(self._open)
+        return (math.inf, math.inf), None
+
+    def _update(self, cell: int):
+        if cell != self.goal:
+            if cell in self.blocked:
+                self._rhs[cell] = math.inf
+            else:
+                g = self._g
+                self._rhs[cell] = 1 + min(
+                    (g[n] for n in self.neighbours[cell] if n not in self.blocked),
+                    default=math.inf,
+                )
+        self._keys.pop(cell, None)
+        if self._g[cell] != self._rhs[cell]:
+            self._push(cell)
+
+    def _compute(self):
+        g, rhs, start = self._g, self._rhs, self.start
+        while True:
+            top_key, cell = self._top()
+            if cell is None or (top_key >= self._key(start) and rhs[start] == g[start]):
+                return
+            self.expansions += 1
+            new_key = self._key(cell)
+            if top_key < new_key:
+                self._push(cell)
+            elif g[cell] > rhs[cell]:
+                g[cell] = rhs[cell]
+                del self._keys[cell]
+                for n in self.neighbours[cell]:
+                    self._update(n)
+            else:
+                g[cell] = math.inf
+                self._update(cell)
+                for n in self.neighbours[cell]:
+                    self._update(n)
+
+    def plan(self, start: int, blocked: set[int]) -> list[int] | None:
+        """Cells from start (excluded) to the goal avoiding blocked, None if there is no path"""
+        if self.start is None:
+            self.start = start
+            self._row = self.heuristic(start)
+            self._push(self.goal)
+        elif start != self.start:
+            self._km += int(self._row[start])  # h(last start, new start)
+            self.start = start
+            self._row = self.heuristic(start)
+
+        changed = blocked ^ self.blocked
+        self.blocked = set(blocked)
+        for cell in changed:
+            self._update(cell)
+            for n in self.neighbours[cell]:
+                self._update(n)
+
+        self._compute()
+        if self._g[start] == math.inf:
+            return None
+
+        path = []
+        cell = start
+        g = self._g
+        while cell != self.goal:
+            cell = min(
+                (n for n in self.neighbours[cell] if n not in self.blocked),
+                key=g.__getitem__,
+            )
+            if g[cell] == math.inf or len(path) > len(g):
+                return None
+            path.append(cell)
+        return path
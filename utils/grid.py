@@ -0,0 +1,141 @@
+import hashlib
+import os
+
+import numpy as np
+
+# distance given to cells that can not be reached
+UNREACHABLE = np.iinfo(np.uint16).max
+
+
+def neighbours_mask(mask: np.ndarray, wrap: bool) -> np.ndarray:
+    """Returns the cells 4-adjacent to any cell of mask (wrapping around the map if wrap)"""
+    if wrap:
+        return (
+            np.roll(mask, 1, axis=0)
+            | np.roll(mask, -1, axis=0)
+            | np.roll(mask, 1, axis=1)
+            | np.roll(mask, -1, axis=1)
+        )
+
+    grown = np.zeros_like(mask)
+    grown[1:, :] |= mask[:-1, :]
+    grown[:-1, :] |= mask[1:, :]
+    grown[:, 1:] |= mask[:, :-1]
+    grown[:, :-1] |= mask[:, 1:]
+    return grown
+
+
+def box_sum(values: np.ndarray, radius: int, wrap: bool = True) -> np.ndarray:
+    """Sum of values over the (2 * radius + 1)^2 box around every cell, from a summed-area table"""
+    padded = np.pad(values, radius, mode="wrap" if wrap else "constant")
+    table = np.pad(padded.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    size = 2 * radius + 1
+    return table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+
+
+def distance_field(
+    sources: np.ndarray, wrap: bool, passable: np.ndarray | None = None
+) -> np.ndarray:
+    """Multi-source BFS: distance (in moves) from every cell to the closest source cell
+
+    Cells that can not be reached (or are not passable) get UNREACHABLE.
+    """
+    distance = np.full(sources.shape, UNREACHABLE, dtype=np.uint16)
+    frontier = sources.copy()
+    unvisited = ~sources if passable is None else passable & ~sources
+    distance[frontier] = 0
+
+    step = 0
+    while frontier.any():
+        step += 1
+        frontier = neighbours_mask(frontier, wrap) & unvisited
+        distance[frontier] = step
+        unvisited &= ~frontier
+
+    return distance
+
+
+def neighbour_table(passable: np.ndarray, wrap: bool) -> np.ndarray:
+    """(W*H, 4) packed passable neighbours of every passable cell
+
+    Missing neighbours (map edges, blocked cells) point to the dummy cell W*H.
+    """
+    width, height = passable.shape
+    cells = width * height
+    xs, ys = np.divmod(np.arange(cells), height)
+    flat_passable = passable.ravel()
+
+    columns = []
+    for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+        nx, ny = xs + dx, ys + dy
+        if wrap:
+            inside = np.ones(cells, dtype=bool)
+            nx, ny = nx % width, ny % height
+        else:
+            inside = (0 <= nx) & (nx < width) & (0 <= ny) & (ny < height)
+            nx, ny = np.clip(nx, 0, width - 1), np.clip(ny, 0, height - 1)
+        neighbour = nx * height + ny
+        columns.append(
+            np.where(inside & flat_passable & flat_passable[neighbour], neighbour, cells)
+        )
+    return np.stack(columns, axis=1)
+
+
+def all_pairs_distances(
+    passable: np.ndarray, wrap: bool, cache_dir: str | None = None
+) -> np.ndarray:
+    """(W*H, W*H) table with the shortest path length between every pair of packed cells
+
+    Runs one BFS per source cell, all of them at once as boolean matrices.
+    When cache_dir is given the table is stored there, keyed by a hash of the map.
+    """
+    path = None
+    if cache_dir is not None:
+        key = hashlib.sha1(
+            np.packbits(passable).tobytes() + repr((passable.shape, wrap)).encode()
+        ).hexdigest()
+        path = os.path.join(cache_dir, f"distances-{key}.npy")
+        if os.path.isfile(path):
+            return np.load(path)
+
+    width, height = passable.shape
+    cells = width * height
+
+    if wrap and passable.all():
+        # nothing blocks the torus, so the BFS distance is the wrapped manhattan distance
+        xs, ys = np.divmod(np.arange(cells), height)
+        dx = np.abs(xs[:, None] - xs[None, :])
+        dy = np.abs(ys[:, None] - ys[None, :])
+        distance = (np.minimum(dx, width - dx) + np.minimum(dy, height - dy)).astype(np.uint16)
+    else:
+        neighbours = neighbour_table(passable, wrap)
+        sources = np.flatnonzero(passable)
+
+        # rows are cells (plus the dummy cell), columns are BFS sources
+        frontier = np.zeros((cells + 1, cells), dtype=bool)
+        frontier[sources, sources] = True
+        visited = frontier[:cells].copy()
+        distance = np.zeros((cells, cells), dtype=np.uint16)
+
+        step = 0
+        while True:
+            step += 1
+            reached = frontier[neighbours[:, 0]]
+            for k in range(1, neighbours.shape[1]):
+                reached |= frontier[neighbours[:, k]]
+            reached &= ~visited
+            if not reached.any():
+                break
+            visited |= reached
+            distance[reached] = step
+            frontier[:cells] = reached
+        distance[~visited] = UNREACHABLE
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as outfile:
+            np.save(outfile, distance)
+        os.replace(tmp_path, path)
+
+    return distance
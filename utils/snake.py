@@ -1,11 +1,17 @@
+import numpy as np
+
 import consts
 
 class Snake:
-    def __init__(self):
-        pass
+    def __init__(self, size: tuple[int, int]):
+        self.size: tuple[int, int] = tuple(size)
+
+        # dense overlay of the last sight: tile per cell and which cells were seen
+        self.sight_tiles = np.zeros(self.size, dtype=np.int8)
+        self.sight_mask = np.zeros(self.size, dtype=bool)
 
     def update(self, data: dict) -> None:
-        
+
         # extract information from the data
         self.players = data["players"]
         self.step = data["step"]
@@ -19,14 +25,49 @@ class Snake:
         self.score = data["score"]
         self.snake_range = data["range"]
         self.snake_traverse = data["traverse"]
-    
-    def check_food_in_sight(self) -> list[tuple[int, int]]:
-        foods_in_sight = []
-        super_foods_in_sight = []
-        for row, cols in self.snake_sight.items():
+
+        self.decode_sight(self.snake_sight)
+
+    def decode_sight(self, sight: dict) -> None:
+        """Decodes the server sight ({x: {y: tile}}) into the dense overlay, without our own body"""
+        xs, ys, tiles = [], [], []
+        for row, cols in sight.items():
             for col, value in cols.items():
-                if value == consts.Tiles.FOOD:
-                    foods_in_sight.append( (int(row), int(col)) )
-                if value == consts.Tiles.SUPER:
-                    super_foods_in_sight.append( (int(row), int(col)) )
-        return foods_in_sight, super_foods_in_sight
\ No newline at end of file
+                xs.append(int(row))
+                ys.append(int(col))
+                tiles.append(value)
+
+        self.sight_tiles.fill(consts.Tiles.PASSAGE)
+        self.sight_mask.fill(False)
+        self.sight_tiles[xs, ys] = tiles
+        self.sight_mask[xs, ys] = True
+
+        # our own body is not an obstacle to avoid, remove it from sight
+        body = np.asarray(self.snake, dtype=np.intp).reshape(-1, 2)
+        self.sight_tiles[body[:, 0], body[:, 1]] = consts.Tiles.PASSAGE
+
+    def cells_of(self, tile: consts.Tiles) -> np.ndarray:
+        """Returns the (x, y) cells in sight holding the given tile, as an (n, 2) array"""
+        return np.argwhere(self.sight_mask & (self.sight_tiles == tile))
+
+    def is_occupied(self, x: int, y: int) -> bool:
+        """Returns True if another snake is in sight at (x, y)"""
+        return self.sight_tiles[x, y] == consts.Tiles.SNAKE
+
+    def nearest_enemy(self, pos, traverse: bool) -> tuple[tuple[int, int], int] | None:
+        """Returns the closest enemy segment in sight to pos and its distance, if any"""
+        enemies = self.cells_of(consts.Tiles.SNAKE)
+        if len(enemies) == 0:
+            return None
+
+        deltas = np.abs(enemies - np.asarray(pos))
+        if traverse:
+            deltas = np.minimum(deltas, np.asarray(self.size) - deltas)
+        distances = deltas.sum(axis=1)
+        closest = int(distances.argmin())
+        return tuple(enemies[closest].tolist()), int(distances[closest])
+
+    def check_food_in_sight(self) -> list[tuple[int, int]]:
+        foods_in_sight = [tuple(cell) for cell in self.cells_of(consts.Tiles.FOOD).tolist()]
+        super_foods_in_sight = [tuple(cell) for cell in self.cells_of(consts.Tiles.SUPER).tolist()]
+        return foods_in_sight, super_foods_in_sight
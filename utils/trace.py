@@ -0,0 +1,122 @@
+"""Tracing for the agent, free when disabled.
+
+Every subsystem logs through its own logger (get_tracer("search") is "agent.search")
+with printf-style arguments, so nothing is formatted unless a record is kept, and
+guards expensive dumps with tracer.isEnabledFor(...).
+
+Configured from the environment on import (see configure):
+
+    TRACE_LEVEL   level of every subsystem (default WARNING)
+    TRACE_LEVELS  per subsystem levels, e.g. "search=DEBUG,moves=INFO"
+    TRACE_FILE    where records are written (default project.log, created on the
+                  first record; empty for stderr)
+    TRACE_RING    keep the last N records of every level in memory (default 0, off),
+                  only written out by dump() on panic moves or death
+"""
+import logging
+import os
+import sys
+from collections import deque
+
+ROOT = "agent"
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+root = logging.getLogger(ROOT)
+_output: logging.Handler | None = None
+_ring: "RingBuffer | None" = None
+
+
+class RingBuffer(logging.Handler):
+    """Keeps the last capacity records, formatted as they arrive (arguments change later)"""
+
+    def __init__(self, capacity: int):
+        super().__init__(logging.DEBUG)
+        self.records: deque[str] = deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(self.format(record))
+
+
+class LevelFilter(logging.Filter):
+    """Lets through the records at or above the level of their subsystem"""
+
+    def __init__(self, level: int, levels: dict[str, int]):
+        super().__init__()
+        self.level = level
+        self.levels = levels
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        subsystem = record.name.removeprefix(ROOT + ".")
+        return record.levelno >= self.levels.get(subsystem, self.level)
+
+
+def get_tracer(subsystem: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{subsystem}")
+
+
+def parse_levels(levels: str) -> dict[str, int]:
+    """"search=DEBUG,moves=INFO" -> {"search": 10, "moves": 20}"""
+    parsed = {}
+    for entry in filter(None, (entry.strip() for entry in levels.split(","))):
+        subsystem, level = entry.split("=")
+        parsed[subsystem.strip()] = logging.getLevelName(level.strip().upper())
+    return parsed
+
+
+def configure(
+    level: str | None = None,
+    levels: str | None = None,
+    file: str | None = None,
+    ring: int | None = None,
+):
+    """(Re)configures the agent loggers, arguments left as None are read from the environment"""
+    global _output, _ring
+    level = logging.getLevelName((level or os.environ.get("TRACE_LEVEL", "WARNING")).upper())
+    levels = parse_levels(os.environ.get("TRACE_LEVELS", "") if levels is None else levels)
+    file = os.environ.get("TRACE_FILE", "project.log") if file is None else file
+    ring = int(os.environ.get("TRACE_RING", "0")) if ring is None else ring
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.propagate = False
+    formatter = logging.Formatter(FORMAT)
+
+    _output = logging.FileHandler(file, delay=True) if file else logging.StreamHandler(sys.stderr)
+    _output.setFormatter(formatter)
+    _output.addFilter(LevelFilter(level, levels))
+    root.addHandler(_output)
+
+    _ring = None
+    if ring > 0:
+        _ring = RingBuffer(ring)
+        _ring.setFormatter(formatter)
+        root.addHandler(_ring)
+
+    # loggers only drop what no handler keeps, the output filter does the rest
+    root.setLevel(logging.DEBUG if _ring else level)
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith(ROOT + "."):
+            logging.getLogger(name).setLevel(logging.NOTSET)
+    if not _ring:
+        for subsystem, subsystem_level in levels.items():
+            get_tracer(subsystem).setLevel(subsystem_level)
+
+
+def dump(reason: str):
+    """Writes out (and clears) the records kept by the ring buffer, if there is one"""
+    if _ring is None or not _ring.records:
+        return
+    record = logging.LogRecord(
+        f"{ROOT}.trace", logging.ERROR, __file__, 0,
+        "Last %d records (%s):\n%s", (len(_ring.records), reason, "\n".join(_ring.records)), None,
+    )
+    _ring.records.clear()
+    _output.acquire()
+    try:
+        _output.emit(record)
+    finally:
+        _output.release()
+
+
+configure()
@@ -1,15 +1,14 @@
 import time
-import logging
-
-logging.basicConfig(
-    filename='project.log',
-    filemode='a',
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG
-)
+import heapq
+from collections import deque
+from itertools import count
 
 from abc import ABC, abstractmethod
 
+from utils.trace import get_tracer
+
+search_log = get_tracer("search")
+
 
 # Dominios de pesquisa
 # Permitem calcular
@@ -45,6 +44,15 @@ class SearchDomain(ABC):
     def satisfies(self, state, goal):
         pass
 
+    # chave compacta e hashable que identifica um estado (tabela de transposicao)
+    # None desativa o conjunto de fechados e recorre a verificacao dos antecessores
+    def state_key(self, state):
+        return None
+
+    # se um estado e um destino aceitavel para um plano parcial (pesquisa anytime)
+    def is_safe(self, state):
+        return True
+
 
 # Problemas concretos a resolver
 # dentro de um determinado dominio
@@ -85,7 +93,7 @@ class SearchNode:
 # Arvores de pesquisa
 class SearchTree:
     # construtor
-    def __init__(self, problem, strategy="breadth"):
+    def __init__(self, problem, strategy="breadth", anytime=False):
         self.problem = problem
         root = SearchNode(
             problem.initial,
@@ -93,12 +101,24 @@ class SearchTree:
             0,
             self.problem.domain.heuristic(self.problem.initial, self.problem.goal),
         )
-        self.open_nodes = [root]
+        self.root = root
         self.strategy = strategy
+        # anytime: guarda o no mais promissor (menor heuristica e seguro) para o
+        # caso de a pesquisa ser interrompida antes de chegar ao objetivo
+        self.anytime = anytime
+        self.best = root
+        self.interrupted = False
+        # fronteira: fila para largura/profundidade, heap para as restantes
+        self.open_nodes = deque() if strategy in ("breadth", "depth") else []
+        # contador de desempate (mantem a ordem de insercao entre prioridades iguais)
+        self._counter = count()
+        self.add_to_open([root])
         self.solution: SearchNode | None = None
         self.non_terminals = 0
         self.highest_cost_nodes = [root]
         self.sum_depths = 0
+        # estados ja expandidos (chaves dadas pelo dominio)
+        self.closed = set()
 
     # obter o caminho (sequencia de estados) da raiz ate um no
     def get_path(self, node):
@@ -114,6 +134,10 @@ class SearchTree:
     def plan(self):
         return self.get_plan(self.solution)
 
+    # plano ate ao melhor no encontrado (pesquisa anytime interrompida)
+    def best_plan(self):
+        return self.get_plan(self.best)
+
     def get_plan(self, node):
         if node.parent is None:
             return []
@@ -142,20 +166,31 @@ class SearchTree:
         return self.solution.cost if self.solution else None
 
     # procurar a solucao
-    def search(self, limit=None, timeout=None):
-        logging.info("Searching Method (Tree search)")
-        logging.info("\tStarting search with snake_body: " + str(self.problem.initial["snake_body"]) + " and goal: " + str(self.problem.goal))
+    # cancel (ex: threading.Event) permite interromper a pesquisa a partir de outra thread
+    def search(self, limit=None, timeout=None, cancel=None):
+        search_log.debug("Searching Method (Tree search)")
+        search_log.debug("\tStarting search from: %s and goal: %s", self.problem.initial, self.problem.goal)
         
         start_time = time.time()
         
-        while self.open_nodes != []:
+        while self.open_nodes:
             
-            # logging.info(f"\tTIMEOUT TIME: {(time.time() - start_time) * 1000} ms")
             if timeout and (time.time() - start_time) > timeout:
-                logging.info("Timeout reached")
+                search_log.info("Timeout reached")
+                self.interrupted = True
+                return None
+            if cancel is not None and cancel.is_set():
+                search_log.info("Search cancelled")
+                self.interrupted = True
                 return None
             
-            node = self.open_nodes.pop(0)
+            node = self.pop_open()
+            key = self.problem.domain.state_key(node.state)
+            if key is not None:
+                if key in self.closed:
+                    continue
+                self.closed.add(key)
+
             self.non_terminals += 1
             if self.problem.goal_test(node.state):
                 self.non_terminals -= 1
@@ -168,7 +203,11 @@ class SearchTree:
             lnewnodes = []
             for a in self.problem.domain.actions(node.state):
                 newstate = self.problem.domain.result(node.state, a)
-                if node.in_parent(newstate):
+                newkey = self.problem.domain.state_key(newstate)
+                if newkey is None:
+                    if node.in_parent(newstate):
+                        continue
+                elif newkey in self.closed:
                     continue
 
                 cost = node.cost + self.problem.domain.cost(node.state, a)
@@ -180,6 +219,8 @@ class SearchTree:
                     a
                 )
                 lnewnodes.append(newnode)
+                if self.anytime:
+                    self.consider(newnode)
 
                 self.sum_depths += newnode.depth
 
@@ -191,18 +232,74 @@ class SearchTree:
             self.add_to_open(lnewnodes)
         return None
 
+    # atualizar o melhor no (so se verifica a seguranca quando a heuristica melhora)
+    def consider(self, node):
+        if node.heuristic < self.best.heuristic and self.problem.domain.is_safe(node.state):
+            self.best = node
+
+    # avancar a raiz para o filho obtido com a accao dada, para continuar a
+    # pesquisa no tick seguinte; mantem os nos abertos abaixo desse filho
+    # (com a heuristica recalculada) e esquece os fechados
+    def advance(self, action):
+        nodes = [entry[2] for entry in self.open_nodes] if isinstance(self.open_nodes, list) else list(self.open_nodes)
+
+        kept = []
+        new_root = None
+        for node in nodes:
+            child = node
+            while child.parent is not None and child.parent is not self.root:
+                child = child.parent
+            if child.parent is self.root and child.action == action:
+                new_root = child
+                kept.append(node)
+        if new_root is None:
+            return False
+
+        new_root.parent = None
+        self.root = new_root
+        self.problem.initial = new_root.state
+        self.solution = None
+        self.interrupted = False
+        self.closed = set()
+
+        domain = self.problem.domain
+        for node in kept:
+            node.heuristic = domain.heuristic(node.state, self.problem.goal)
+        self.best = new_root
+        new_root.heuristic = domain.heuristic(new_root.state, self.problem.goal)
+        for node in kept:
+            if node is not new_root:
+                self.consider(node)
+
+        self.open_nodes = deque() if self.strategy in ("breadth", "depth") else []
+        self._counter = count()
+        self.add_to_open(kept)
+        return True
+
     # juntar novos nos a lista de nos abertos de acordo com a estrategia
     def add_to_open(self, lnewnodes):
         if self.strategy == "breadth":
             self.open_nodes.extend(lnewnodes)
         elif self.strategy == "depth":
-            self.open_nodes[:0] = lnewnodes
-        elif self.strategy == "uniform":
-            self.open_nodes.extend(lnewnodes)
-            self.open_nodes.sort(key=lambda node: node.cost)
-        elif self.strategy == "greedy":
-            self.open_nodes.extend(lnewnodes)
-            self.open_nodes.sort(key=lambda node: node.heuristic)
-        elif self.strategy == "a*":
-            self.open_nodes.extend(lnewnodes)
-            self.open_nodes.sort(key=lambda node: node.heuristic + node.cost)
\ No newline at end of file
+            self.open_nodes.extendleft(reversed(lnewnodes))
+        else:
+            for node in lnewnodes:
+                heapq.heappush(
+                    self.open_nodes, (self.priority(node), next(self._counter), node)
+                )
+
+    # prioridade de um no na heap de acordo com a estrategia
+    def priority(self, node):
+        if self.strategy == "uniform":
+            return node.cost
+        if self.strategy == "greedy":
+            return node.heuristic
+        if self.strategy == "a*":
+            return node.heuristic + node.cost
+        raise ValueError(f"Unknown search strategy: {self.strategy}")
+
+    # retirar o proximo no a expandir da fronteira
+    def pop_open(self):
+        if self.strategy in ("breadth", "depth"):
+            return self.open_nodes.popleft()
+        return heapq.heappop(self.open_nodes)[2]
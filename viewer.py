@@ -7,6 +7,7 @@ import sys
 import pprint
 
 from consts import Tiles
+from protocol import PROTOCOLS, ViewerDecoder
 import pygame
 import websockets
 
@@ -57,7 +58,7 @@ async def main(SCALE):
             await asyncio.sleep(0.1)
 
     logging.debug("Initial game status: %s", state)
-    newgame_json = json.loads(state)
+    newgame_json = state
 
     new_game = True
     GAME_SPEED = newgame_json["fps"]
@@ -78,7 +79,7 @@ async def main(SCALE):
         should_quit()
 
         try:
-            state = json.loads(q.get_nowait())
+            state = q.get_nowait()
             pprint.pprint(state)
 
             if "snakes" in state and "food" in state:
@@ -200,13 +201,16 @@ async def main(SCALE):
         pygame.display.flip()
 
 
-async def messages_handler(ws_path, queue):
+async def messages_handler(ws_path, queue, protocol="json", room="default"):
     async with websockets.connect(ws_path) as websocket:
-        await websocket.send(json.dumps({"cmd": "join"}))
+        await websocket.send(
+            json.dumps({"cmd": "join", "protocol": protocol, "room": room})
+        )
+        decoder = ViewerDecoder()
 
         while True:
             r = await websocket.recv()
-            queue.put_nowait(r)
+            queue.put_nowait(decoder.decode(r))
 
 
 if __name__ == "__main__":
@@ -219,6 +223,10 @@ if __name__ == "__main__":
         "--scale", help="reduce size of window by x times", type=int, default=1
     )
     parser.add_argument("--port", help="TCP port", type=int, default=PORT)
+    parser.add_argument(
+        "--protocol", help="Stream protocol", choices=PROTOCOLS, default="json"
+    )
+    parser.add_argument("--room", help="Room to watch", default="default")
     args = parser.parse_args()
     SCALE = 32 * (1 / args.scale)
 
@@ -231,7 +239,10 @@ if __name__ == "__main__":
 
     try:
         LOOP.run_until_complete(
-            asyncio.gather(messages_handler(ws_path, q), main_loop(q, SCALE=SCALE))
+            asyncio.gather(
+                messages_handler(ws_path, q, args.protocol, args.room),
+                main_loop(q, SCALE=SCALE),
+            )
         )
     finally:
         LOOP.stop()
\ No newline at end of file